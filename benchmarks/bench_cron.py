@@ -0,0 +1,74 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cron import CronExpr
+
+# Пропускателна способност на next_after() върху N cron израза (по
+# подразбиране 1 000 000) - компилиране веднъж, после следващо време.
+# За сравнение: наивно обхождане минута по минута върху малка извадка.
+# Употреба: python benchmarks/bench_cron.py [1000000]
+
+ZONES = [None, "Europe/Sofia", "America/New_York", "Asia/Tokyo"]
+NAIVE_SAMPLE = 50
+
+
+def random_expr(rng: random.Random) -> str:
+    minute = rng.choice(["0", "*/5", "*/15", str(rng.randrange(60)), "0,30"])
+    hour = rng.choice(["*", "9", "8-17", str(rng.randrange(24)), "*/6"])
+    day = rng.choice(["*", "*", "1", "15", "L", "1,15"])
+    month = rng.choice(["*", "*", "*", "1-6", "jan,jul", "*/3"])
+    weekday = rng.choice(["*", "*", "1-5", "mon", f"{rng.randrange(7)}#{rng.randint(1, 4)}", "5L", "sat,sun"])
+    return f"{minute} {hour} {day} {month} {weekday}"
+
+
+def naive_next(cron: CronExpr, ts: float) -> float:
+    import calendar
+    from datetime import datetime
+    t = (int(ts) // 60 + 1) * 60
+    while True:
+        dt = datetime.fromtimestamp(t, cron.tz)
+        first_dow, length = calendar.monthrange(dt.year, dt.month)
+        if (cron.minutes >> dt.minute & 1 and cron.hours >> dt.hour & 1 and cron.months >> dt.month & 1
+                and cron._month_mask((first_dow + 1) % 7, length) >> dt.day & 1):
+            return float(t)
+        t += 60
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = random.Random(42)
+    now = time.time()
+    specs = [(random_expr(rng), rng.choice(ZONES), now + rng.uniform(0, 86400 * 30)) for _ in range(n)]
+
+    compile_time = 0.0
+    next_time = 0.0
+    checked = 0
+    naive_time = 0.0
+    for i, (expr, tz, ts) in enumerate(specs):
+        started = time.perf_counter()
+        cron = CronExpr(expr, tz)
+        compiled = time.perf_counter()
+        fire_at = cron.next_after(ts)
+        # Второ извикване - вече с кеширана маска на месеца, както при работа
+        fire_at = cron.next_after(fire_at)
+        done = time.perf_counter()
+        compile_time += compiled - started
+        next_time += (done - compiled) / 2
+        if i < NAIVE_SAMPLE:
+            started = time.perf_counter()
+            expected = naive_next(cron, naive_next(cron, ts))
+            naive_time += time.perf_counter() - started
+            assert expected == fire_at, (expr, tz, ts, expected, fire_at)
+            checked += 1
+
+    print(f"изрази={n}  компилиране={compile_time:6.2f}s ({n / compile_time:9.0f}/s)")
+    print(f"next_after={next_time:6.2f}s ({n / next_time:9.0f}/s, {next_time / n * 1e6:.2f} µs/бр.)")
+    print(f"наивно (минута по минута, {checked} бр.): {naive_time / checked * 1e6 / 2:.0f} µs/бр. -> x{naive_time / 2 / checked / (next_time / n):.0f}")
+
+
+if __name__ == "__main__":
+    main()
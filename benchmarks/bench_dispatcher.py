@@ -0,0 +1,171 @@
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dispatcher import SendDispatcher
+
+# Локален фалшив HTTP endpoint с лимит на канал (по подобие на Discord)
+# и сравнение: наивно пращане (задача на съобщение) срещу SendDispatcher.
+# Накрая: справедливост между guild-ове при общ лимит на едновременните заявки.
+# Употреба: python benchmarks/bench_dispatcher.py
+
+CHANNELS = 20
+MESSAGES_PER_CHANNEL = 100
+# Мащабиран лимит: LIMIT заявки на WINDOW секунди за канал
+LIMIT = 5
+WINDOW = 0.25
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"429, retry after {retry_after:.3f}s")
+        self.status = 429
+        self.retry_after = retry_after
+
+
+class FakeDiscord:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.windows = {}
+        self.accepted = 0
+        self.rejected = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info["channel_id"])
+        payload = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        start, count = self.windows.get(channel_id, (now, 0))
+        if now - start >= WINDOW:
+            start, count = now, 0
+        if count >= LIMIT:
+            self.rejected += 1
+            return web.json_response({"retry_after": WINDOW - (now - start)}, status=429)
+        self.windows[channel_id] = (start, count + 1)
+        self.accepted += 1
+        return web.json_response({"id": self.accepted, "content": payload["content"]})
+
+
+async def start_server(fake: FakeDiscord):
+    app = web.Application()
+    app.router.add_post("/channels/{channel_id}/messages", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def make_sender(session: ClientSession, base_url: str):
+    async def send(channel_id: int, content: str):
+        async with session.post(f"{base_url}/channels/{channel_id}/messages", json={"content": content}) as resp:
+            data = await resp.json()
+            if resp.status == 429:
+                raise RateLimitedError(data["retry_after"])
+    return send
+
+
+async def naive(send):
+    # Старият модел: всяко съобщение праща самостоятелно и при 429 просто чака
+    async def one(channel_id, content):
+        while True:
+            try:
+                return await send(channel_id, content)
+            except RateLimitedError as e:
+                await asyncio.sleep(e.retry_after)
+
+    await asyncio.gather(*(
+        one(c, f"msg {c}-{i}") for c in range(CHANNELS) for i in range(MESSAGES_PER_CHANNEL)
+    ))
+
+
+async def with_dispatcher(send, coalesce: bool):
+    dispatcher = SendDispatcher(send, rate=LIMIT / WINDOW, burst=LIMIT, coalesce=coalesce, base_backoff=0.05)
+    for i in range(MESSAGES_PER_CHANNEL):
+        for c in range(CHANNELS):
+            dispatcher.submit(c, f"msg {c}-{i}", f"{c}-{i}")
+    await dispatcher.drain()
+    return dispatcher
+
+
+async def run(name: str, scenario):
+    fake = FakeDiscord()
+    runner, base_url = await start_server(fake)
+    async with ClientSession() as session:
+        started = time.perf_counter()
+        await scenario(make_sender(session, base_url))
+        elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    delivered = CHANNELS * MESSAGES_PER_CHANNEL
+    print(
+        f"{name:<22} {elapsed:6.2f}s  messages/s={delivered / elapsed:8.1f}  "
+        f"http_sends/s={fake.accepted / elapsed:7.1f}  accepted={fake.accepted:<5} 429s={fake.rejected}"
+    )
+
+
+# === Справедливост между guild-ове ===
+# Голям guild A (BUSY_CHANNELS канала) и малък guild B (1 канал) при общ лимит
+# от MAX_IN_FLIGHT едновременни заявки и сървър с латентност. Мери се кога
+# B получава последното си съобщение: обща FIFO опашка (без групи), кръгово
+# раздаване по guild и кръгово + твърд лимит на guild.
+BUSY_CHANNELS = 40
+BUSY_MESSAGES = 25
+SMALL_MESSAGES = 5
+MAX_IN_FLIGHT = 10
+LATENCY = 0.02
+
+
+async def fairness(name: str, grouped: bool, group_in_flight: int = 0):
+    fake = FakeDiscord(latency=LATENCY)
+    runner, base_url = await start_server(fake)
+    small_channel = 10_000
+    done = {}
+
+    def on_sent(msg_ids, channel_id):
+        done.setdefault("busy" if channel_id != small_channel else "small", []).append(time.perf_counter())
+
+    async with ClientSession() as session:
+        dispatcher = SendDispatcher(
+            make_sender(session, base_url),
+            rate=LIMIT / WINDOW,
+            burst=LIMIT,
+            base_backoff=0.05,
+            max_in_flight=MAX_IN_FLIGHT,
+            group_in_flight=group_in_flight,
+            on_sent=on_sent
+        )
+        started = time.perf_counter()
+        for i in range(BUSY_MESSAGES):
+            for c in range(BUSY_CHANNELS):
+                # Без групи всеки канал е отделна група - като FIFO между каналите
+                dispatcher.submit(c, f"busy {c}-{i}", f"{c}-{i}", group="A" if grouped else None)
+        await asyncio.sleep(0.05)
+        small_started = time.perf_counter()
+        for i in range(SMALL_MESSAGES):
+            dispatcher.submit(small_channel, f"small {i}", f"s-{i}", group="B" if grouped else None)
+        await dispatcher.drain()
+    await runner.cleanup()
+    small = max(done["small"]) - small_started
+    busy = max(done["busy"]) - started
+    print(f"{name:<22} малък guild: {small:6.2f}s  голям guild: {busy:6.2f}s")
+
+
+async def main():
+    await run("naive", naive)
+    await run("dispatcher", lambda send: with_dispatcher(send, coalesce=False))
+    await run("dispatcher+coalesce", lambda send: with_dispatcher(send, coalesce=True))
+    print(f"--- справедливост: {BUSY_CHANNELS}x{BUSY_MESSAGES} срещу 1x{SMALL_MESSAGES}, общо {MAX_IN_FLIGHT} в полет, латентност {LATENCY * 1000:.0f} ms")
+    await fairness("по канал", grouped=False)
+    await fairness("кръгово по guild", grouped=True)
+    await fairness("кръгово + лимит 4", grouped=True, group_in_flight=4)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import ScheduleIndex
+
+# Латентност на автодопълването и търсенето в индекса при N графика
+# (по подразбиране 100 000). Целта е автодопълване под 1 ms.
+# Употреба: python benchmarks/bench_index.py [100000]
+
+WORDS = ["morning", "evening", "promo", "event", "reminder", "raid", "daily", "weekly", "news", "poll"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def timed(fn, args_list):
+    times = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def report(name, times):
+    print(f"{name:<32} p50={percentile(times, 50) * 1e6:8.1f} µs  p99={percentile(times, 99) * 1e6:8.1f} µs  max={max(times) * 1e6:8.1f} µs")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(7)
+    channels = [100000 + i for i in range(max(50, n // 200))]
+    creators = [f"user{i}" for i in range(200)]
+    items = [
+        (f"{rng.choice(WORDS)}-{i:06d}", rng.choice(channels), rng.choice(creators), rng.choice(("active", "active", "stopped")))
+        for i in range(n)
+    ]
+
+    index = ScheduleIndex()
+    started = time.perf_counter()
+    index.rebuild(items)
+    print(f"n={n}  rebuild={time.perf_counter() - started:.3f}s")
+
+    prefixes = [(rng.choice(WORDS)[:rng.randint(0, 5)],) for _ in range(2000)]
+    report("complete(prefix)", timed(index.complete, prefixes))
+    report("complete(prefix, status=active)", timed(lambda p: index.complete(p, status="active"), prefixes))
+    digits = [(f"{rng.choice(WORDS)}-{rng.randint(0, n):06d}"[:-2],) for _ in range(2000)]
+    report("complete(почти пълно ID)", timed(index.complete, digits))
+
+    queries = [(None, rng.choice(channels), rng.choice(creators), None) for _ in range(2000)]
+    report("query(channel, creator)", timed(index.query, queries))
+    queries = [("active", rng.choice(channels), None, None) for _ in range(2000)]
+    report("query(status, channel)", timed(index.query, queries))
+
+    updates = [(msg_id, rng.choice(channels), creator, status) for msg_id, _, creator, status in rng.sample(items, 2000)]
+    report("update(смяна на канал)", timed(index.update, updates))
+    new_items = [(f"new-{i:06d}", rng.choice(channels), "bench", "active") for i in range(2000)]
+    report("update(нов запис)", timed(index.update, new_items))
+    report("remove", timed(index.remove, [(item[0],) for item in new_items]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Schedule
+
+# Памет на график: стария dict запис срещу Schedule със __slots__.
+# Текстът на съобщението е общ и в двата случая, за да се мери самата структура.
+# Schedule се мери с текущото разположение в bot.py: запис с guild_id и
+# ключ "<guild_id>:<id>" в active_messages (отделен низ от id-то).
+# Употреба: python benchmarks/bench_records.py [1000000]
+
+MESSAGE = "Напомняне: седмичната среща започва след 15 минути."
+CREATORS = ["admin", "moderator", "marin"]
+GUILD_ID = 400000000000000000
+
+
+def dict_record(i: int) -> dict:
+    # Както при стария save/load: creator и status идват от JSON, не са общи
+    return {
+        "task": None,
+        "message": MESSAGE,
+        "interval": 60,
+        "repeat": 0,
+        "id": f"msg-{i}",
+        "creator": "".join(CREATORS[i % 3]),
+        "status": "".join("active"),
+        "channel_id": 100000000000000000 + i % 50,
+        "next_fire_at": 1700000000.0 + i,
+        "sent_count": i % 7
+    }
+
+
+def slots_record(i: int) -> Schedule:
+    return Schedule(
+        id=f"msg-{i}",
+        message=MESSAGE,
+        interval=60,
+        repeat=0,
+        creator="".join(CREATORS[i % 3]),
+        status="".join("active"),
+        channel_id=100000000000000000 + i % 50,
+        next_fire_at=1700000000.0 + i,
+        sent_count=i % 7,
+        guild_id=GUILD_ID
+    )
+
+
+def measure(factory, n: int):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    if factory is dict_record:
+        records = {f"msg-{i}": factory(i) for i in range(n)}
+    else:
+        # Ключът "<guild_id>:<id>" е отделен низ; планировчикът ползва същия
+        # обект, затова се брои веднъж
+        records = {r.key: r for r in map(factory, range(n))}
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return records, current, elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    results = {}
+    for name, factory in (("dict", dict_record), ("slots", slots_record)):
+        records, current, elapsed = measure(factory, n)
+        results[name] = current
+        print(f"{name:<6} n={n}  {current / 1024 / 1024:8.1f} MiB  {current / n:6.1f} B/запис  build={elapsed:5.2f}s")
+        if name == "slots":
+            started = time.perf_counter()
+            payloads = [r.to_storage() for r in records.values()]
+            encode = time.perf_counter() - started
+            started = time.perf_counter()
+            for p in payloads:
+                Schedule.from_storage(p)
+            decode = time.perf_counter() - started
+            print(f"codec  encode={encode:5.2f}s  decode={decode:5.2f}s  ({len(payloads[0])} B на ред)")
+        del records
+    print(f"dict / slots = {results['dict'] / results['slots']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import Scheduler
+
+# Сравнение: по една asyncio задача на съобщение (стария дизайн)
+# срещу един heap-базиран Scheduler.
+# Употреба: python benchmarks/bench_scheduler.py [10000 100000]
+
+RUN_SECONDS = 3.0
+CHURN = 10000
+
+
+async def legacy_design(n: int):
+    sent = 0
+
+    async def task_func(interval: float):
+        nonlocal sent
+        while True:
+            sent += 1
+            await asyncio.sleep(interval)
+
+    tracemalloc.start()
+    cpu = time.process_time()
+    tasks = {i: asyncio.create_task(task_func(random.uniform(1, 60))) for i in range(n)}
+    await asyncio.sleep(0)
+    setup_cpu = time.process_time() - cpu
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cpu = time.process_time()
+    for i in random.sample(range(n), min(CHURN, n)):
+        tasks[i].cancel()
+        tasks[i] = asyncio.create_task(task_func(random.uniform(1, 60)))
+    await asyncio.sleep(0)
+    churn_cpu = time.process_time() - cpu
+
+    cpu = time.process_time()
+    await asyncio.sleep(RUN_SECONDS)
+    run_cpu = time.process_time() - cpu
+
+    for task in tasks.values():
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return peak, setup_cpu, churn_cpu, run_cpu, sent
+
+
+async def heap_design(n: int):
+    sent = 0
+    intervals = {}
+
+    def on_fire(msg_id, when):
+        nonlocal sent
+        sent += 1
+        return when + intervals[msg_id]
+
+    scheduler = Scheduler(on_fire, clock=time.monotonic)
+    tracemalloc.start()
+    cpu = time.process_time()
+    now = scheduler.now()
+    for i in range(n):
+        intervals[i] = random.uniform(1, 60)
+        scheduler.schedule(i, now)
+    scheduler.start()
+    # run_due изпълнява до max_batch на минаване - чакаме всички първи изпращания
+    while sent < n:
+        await asyncio.sleep(0)
+    setup_cpu = time.process_time() - cpu
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cpu = time.process_time()
+    now = scheduler.now()
+    target = sent + min(CHURN, n)
+    for i in random.sample(range(n), min(CHURN, n)):
+        # Като новата задача в стария дизайн: първото изпращане е веднага
+        intervals[i] = random.uniform(1, 60)
+        scheduler.schedule(i, now)
+    while sent < target:
+        await asyncio.sleep(0)
+    churn_cpu = time.process_time() - cpu
+
+    cpu = time.process_time()
+    await asyncio.sleep(RUN_SECONDS)
+    run_cpu = time.process_time() - cpu
+
+    scheduler.stop()
+    return peak, setup_cpu, churn_cpu, run_cpu, sent
+
+
+def report(name, n, result):
+    peak, setup_cpu, churn_cpu, run_cpu, sent = result
+    print(
+        f"{name:<8} n={n:<7} peak={peak / 1024 / 1024:8.1f} MiB  setup_cpu={setup_cpu:6.3f}s  "
+        f"churn_cpu={churn_cpu:6.3f}s  run_cpu={run_cpu:6.3f}s  fires={sent}"
+    )
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000]
+    for n in sizes:
+        random.seed(n)
+        report("tasks", n, asyncio.run(legacy_design(n)))
+        random.seed(n)
+        report("heap", n, asyncio.run(heap_design(n)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import SqliteStore
+
+# Цена на една промяна: стария пълен JSON презапис срещу upsert на един ред.
+# Употреба: python benchmarks/bench_storage.py [1000 10000 100000]
+
+MUTATIONS = 200
+
+
+def record(i: int) -> dict:
+    return {
+        "message": f"Съобщение {i}",
+        "interval": 60,
+        "repeat": 0,
+        "id": f"msg-{i}",
+        "creator": "admin",
+        "status": "active",
+        "channel_id": 100000000000000000 + i % 50,
+    }
+
+
+def legacy_rewrite(path: str, data: dict) -> float:
+    started = time.perf_counter()
+    for i in range(MUTATIONS):
+        data[f"msg-{i}"]["interval"] = i
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+    return (time.perf_counter() - started) / MUTATIONS
+
+
+async def store_upserts(path: str, data: dict) -> float:
+    store = SqliteStore(path)
+    for msg_id, msg in data.items():
+        store.upsert(msg_id, json.dumps(msg, ensure_ascii=False))
+    await store.flush()
+    started = time.perf_counter()
+    for i in range(MUTATIONS):
+        data[f"msg-{i}"]["interval"] = i
+        store.upsert(f"msg-{i}", json.dumps(data[f"msg-{i}"], ensure_ascii=False))
+        # Всяка промяна отделно, за да мерим цената на единичен flush
+        await store.flush()
+    elapsed = (time.perf_counter() - started) / MUTATIONS
+
+    started = time.perf_counter()
+    loaded = await store.load_all()
+    load_time = time.perf_counter() - started
+    assert len(loaded) == len(data)
+    store.close()
+    return elapsed, load_time
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            data = {f"msg-{i}": record(i) for i in range(n)}
+            per_json = legacy_rewrite(os.path.join(tmp, f"{n}.json"), data)
+            per_store, load_time = asyncio.run(store_upserts(os.path.join(tmp, f"{n}.db"), data))
+            print(
+                f"n={n:<7} json_rewrite={per_json * 1000:8.2f} ms/op  "
+                f"sqlite_upsert={per_store * 1000:6.2f} ms/op  load={load_time * 1000:7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import selectors
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Локална симулация на клъстерния режим: няколко процеса bot.py с обща
+# SQLite база и фалшив канал, който записва всяко изпращане във файл.
+# Времето е ускорено SPEED пъти (общо за всички процеси), така че минутните
+# интервали минават за секунди. По средата един процес се убива с SIGKILL,
+# а друг спира чужд график през stop_action (маршрутизиране през базата).
+# Употреба: python benchmarks/cluster_sim.py [--workers 3 --schedules 2000]
+
+SPEED = 20.0
+GUILD_ID = 900000
+
+
+# === Ускорен часовник, общ за всички процеси ===
+def virtual_now(epoch: float) -> float:
+    return epoch + (time.time() - epoch) * SPEED
+
+
+class ScaledClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(selectors.DefaultSelector())
+        real_select = self._selector.select
+        self._selector.select = lambda timeout=None: real_select(None if timeout is None else timeout / SPEED)
+
+    def time(self) -> float:
+        return time.monotonic() * SPEED
+
+
+class RecordingChannel:
+    def __init__(self, channel_id: int, out, clock):
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.out = out
+        self.clock = clock
+
+    async def send(self, content: str):
+        now = self.clock()
+        for msg_id in content.split("\n"):
+            self.out.write(f"{now:.3f} {msg_id}\n")
+        self.out.flush()
+
+
+class FakeResponse:
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+# === Процес-работник ===
+async def run_worker(args) -> None:
+    import bot as bot_module
+
+    epoch = args.epoch
+    clock = lambda: virtual_now(epoch)
+    out = open(os.path.join(args.dir, f"sends-{args.worker_id}.log"), "a", buffering=1)
+    channels = {}
+
+    def get_channel(channel_id):
+        channel = channels.get(channel_id)
+        if channel is None:
+            channel = channels[channel_id] = RecordingChannel(channel_id, out, clock)
+        return channel
+
+    bot_module.bot.get_channel = get_channel
+    bot_module.scheduler.clock = clock
+    bot_module.dispatcher.clock = asyncio.get_running_loop().time
+    bot_module.cluster.clock = clock
+
+    bot_module.scheduler.start()
+    await bot_module.cluster.join()
+    await bot_module.load_messages()
+    bot_module.cluster.start()
+
+    if args.stop_target:
+        # Чужд график, спрян от този процес: собственикът трябва да го види в журнала
+        await asyncio.sleep(args.stop_at)
+        interaction = SimpleNamespace(guild_id=GUILD_ID, response=FakeResponse())
+        await bot_module.stop_action(interaction, args.stop_target)
+        with open(os.path.join(args.dir, "stop.json"), "w") as f:
+            json.dump({"id": args.stop_target, "at": clock(), "by": args.worker_id}, f)
+    await asyncio.sleep(args.duration - (args.stop_at if args.stop_target else 0))
+    await bot_module.cluster.stop()
+    await bot_module.store.flush()
+
+
+# === Родителски процес ===
+def seed(db_path: str, schedules: int, channels: int, now: float) -> None:
+    from models import STATUS_ACTIVE, Schedule
+    from storage import SqliteStore
+
+    store = SqliteStore(db_path)
+    rng = random.Random(1)
+    store.upsert_many(
+        (f"{GUILD_ID}:s{i:05d}", Schedule(
+            id=f"s{i:05d}",
+            message=f"s{i:05d}",
+            interval=1,
+            repeat=0,
+            creator="sim",
+            status=STATUS_ACTIVE,
+            channel_id=500000 + i % channels,
+            next_fire_at=now + rng.uniform(0, 60),
+            guild_id=GUILD_ID
+        ).to_storage())
+        for i in range(schedules)
+    )
+    store.set_guild_active(GUILD_ID, True)
+    store.close()
+
+
+def owners(workers, channels: int) -> dict:
+    from cluster import rendezvous_owner
+    return {500000 + c: rendezvous_owner(500000 + c, workers) for c in range(channels)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симулация на клъстерен режим с няколко процеса")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--schedules", type=int, default=2000)
+    parser.add_argument("--channels", type=int, default=60)
+    parser.add_argument("--minutes", type=float, default=6, help="симулирани минути")
+    parser.add_argument("--kill-at", type=float, default=2.5, help="симулирана минута за SIGKILL на последния процес")
+    # Вътрешни (за процесите-работници)
+    parser.add_argument("--worker-id")
+    parser.add_argument("--dir")
+    parser.add_argument("--epoch", type=float)
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--stop-target")
+    parser.add_argument("--stop-at", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.worker_id:
+        asyncio.set_event_loop(ScaledClockLoop())
+        asyncio.get_event_loop().run_until_complete(run_worker(args))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="amb-cluster-")
+    db_path = os.path.join(workdir, "cluster.db")
+    epoch = time.time()
+    start = virtual_now(epoch) + 5
+    seed(db_path, args.schedules, args.channels, start)
+    worker_ids = [f"w{i}" for i in range(args.workers)]
+    owner_by_channel = owners(worker_ids, args.channels)
+
+    # Целта за спиране е на канал, който не е на w0
+    stop_target = next(f"s{i:05d}" for i in range(args.schedules) if owner_by_channel[500000 + i % args.channels] != "w0")
+    env = dict(
+        os.environ,
+        MESSAGES_DB=db_path,
+        METRICS_PORT="0",
+        LOG_LEVEL="WARNING",
+        CLUSTER_LEASE_SECONDS="15",
+        CLUSTER_HEARTBEAT_SECONDS="5",
+        CLUSTER_POLL_SECONDS="1",
+        SEND_RATE="5",
+        SEND_BURST="50"
+    )
+    env.pop("DISCORD_TOKEN", None)
+    duration = args.minutes * 60
+    procs = {}
+    for worker_id in worker_ids:
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--worker-id", worker_id, "--dir", workdir,
+            "--epoch", repr(epoch), "--duration", str(duration)
+        ]
+        if worker_id == "w0":
+            cmd += ["--stop-target", stop_target, "--stop-at", str(90)]
+        procs[worker_id] = subprocess.Popen(cmd, env={**env, "CLUSTER_WORKER_ID": worker_id}, cwd=workdir,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    victim = worker_ids[-1]
+    time.sleep(args.kill_at * 60 / SPEED)
+    kill_time = virtual_now(epoch)
+    procs[victim].send_signal(signal.SIGKILL)
+    print(f"💀 {victim} убит на {kill_time - start:.0f} сек. (симулирано)")
+    for worker_id, proc in procs.items():
+        _, err = proc.communicate(timeout=duration / SPEED + 60)
+        if proc.returncode not in (0, -signal.SIGKILL):
+            print(f"❌ {worker_id} завърши с {proc.returncode}:\n{err[-3000:]}")
+
+    # --- Анализ ---
+    sends = defaultdict(list)
+    for worker_id in worker_ids:
+        path = os.path.join(workdir, f"sends-{worker_id}.log")
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                at, msg_id = line.split()
+                sends[msg_id].append((float(at), worker_id))
+    with open(os.path.join(workdir, "stop.json")) as f:
+        stop = json.load(f)
+
+    duplicates = 0
+    victim_gaps = []
+    for i in range(args.schedules):
+        msg_id = f"s{i:05d}"
+        events = sorted(sends.get(msg_id, []))
+        for (a, wa), (b, wb) in zip(events, events[1:]):
+            if b - a < 30 and wa != wb:
+                duplicates += 1
+        if owner_by_channel[500000 + i % args.channels] == victim:
+            after = [at for at, _ in events if at > kill_time]
+            before = [at for at, _ in events if at <= kill_time]
+            if after and before:
+                victim_gaps.append(after[0] - before[-1])
+    total = sum(len(v) for v in sends.values())
+    late_stop = [at for at, _ in sends.get(stop["id"], []) if at > stop["at"] + 5]
+    per_worker = defaultdict(int)
+    for events in sends.values():
+        for _, worker_id in events:
+            per_worker[worker_id] += 1
+
+    print(f"📨 Изпращания: {total} ({dict(per_worker)})")
+    print(f"🔁 Дублирани (два процеса <30 сек.): {duplicates}")
+    if victim_gaps:
+        print(f"🩹 Поемане на графиците на {victim}: {len(victim_gaps)} графика, макс. пауза {max(victim_gaps):.0f} сек. (интервал 60 сек.)")
+    print(f"⏹️ Спиране на {stop['id']} от {stop['by']}: изпращания след спирането = {len(late_stop)}")
+    print(f"📁 {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import selectors
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Симулация на bot.py без Discord: фалшив канал/HTTP слой и виртуален
+# часовник. Всеки размер се пуска в отделен процес (за чист пиков RSS),
+# а резултатите се записват като JSON в benchmarks/results/.
+# Употреба:
+#   python benchmarks/harness.py                      # 1k, 10k, 100k
+#   python benchmarks/harness.py --sizes 1000 --minutes 30
+#   python benchmarks/harness.py --baseline benchmarks/results/<стар>.json
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+EPOCH = 1700000000.0
+GUILD_ID = 900000
+
+
+# === Виртуален часовник ===
+# Часовникът на loop-а е реалното време плюс пропуснатото чакане: когато
+# няма готова работа, вместо да спи, loop-ът прескача до следващия таймер.
+# Така CPU времето се отчита реално (и се вижда като закъснение), а
+# празните интервали от минути минават мигновено.
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(selectors.DefaultSelector())
+        self.skipped = 0.0
+        real_select = self._selector.select
+
+        def select(timeout=None):
+            events = real_select(0)
+            if events or timeout == 0:
+                return events
+            if timeout is None:
+                # Само I/O от нишки (SQLite) - чакаме истински
+                return real_select(None)
+            self.skipped += timeout
+            return []
+
+        self._selector.select = select
+
+    def time(self) -> float:
+        return time.monotonic() + self.skipped
+
+
+# === Фалшив Discord транспорт ===
+class FakeRateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"429, retry after {retry_after:.2f}s")
+        self.status = 429
+        self.retry_after = retry_after
+
+
+class FakeChannel:
+    # Лимит като на Discord: 5 съобщения за 5 секунди на канал
+    def __init__(self, channel_id: int, stats: "SimStats", latency: float):
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.stats = stats
+        self.latency = latency
+        self.window_start = 0.0
+        self.window_count = 0
+
+    async def send(self, content: str):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if now - self.window_start >= 5:
+            self.window_start, self.window_count = now, 0
+        if self.window_count >= 5:
+            self.stats.rate_limited += 1
+            raise FakeRateLimited(5 - (now - self.window_start))
+        self.window_count += 1
+        await asyncio.sleep(self.latency)
+        self.stats.record_send(content)
+
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+
+    async def edit_message(self, *args, **kwargs):
+        self.done = True
+
+    async def send_modal(self, *args, **kwargs):
+        self.done = True
+
+
+def fake_interaction(bot_module):
+    return SimpleNamespace(
+        user=SimpleNamespace(name="bench", roles=[]),
+        permissions=bot_module.discord.Permissions(administrator=True),
+        guild=None,
+        guild_id=GUILD_ID,
+        response=FakeResponse()
+    )
+
+
+class SimStats:
+    def __init__(self, bot_module):
+        self.bot = bot_module
+        self.intended = {}
+        self.drift = []
+        self.sends = 0
+        self.rate_limited = 0
+        self.first_send_real = None
+        self.last_send_real = None
+
+    def record_send(self, content: str):
+        now = self.bot.scheduler.now()
+        for msg_id in content.split("\n"):
+            intended = self.intended.pop(msg_id, None)
+            if intended is not None:
+                self.drift.append(now - intended)
+        self.sends += 1
+        real = time.perf_counter()
+        if self.first_send_real is None:
+            self.first_send_real = real
+        self.last_send_real = real
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(values) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+        "mean": statistics.fmean(values) if values else 0.0
+    }
+
+
+# === Един сценарий за даден брой графици ===
+async def simulate(size: int, minutes: float, latency: float, seed: int) -> dict:
+    import bot as bot_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+    loop = asyncio.get_running_loop()
+    random.seed(seed)
+    stats = SimStats(bot_module)
+    channel_count = max(50, size // 20)
+    channels = {100000 + i: FakeChannel(100000 + i, stats, latency) for i in range(channel_count)}
+
+    bot_module.bot.get_channel = channels.get
+    bot_module.scheduler.clock = lambda: EPOCH + loop.time()
+    bot_module.dispatcher.clock = loop.time
+
+    original_fire = bot_module.scheduler._on_fire
+
+    def on_fire(key, when):
+        msg = bot_module.active_messages.get(key)
+        if msg is not None:
+            stats.intended[msg.id] = msg.next_fire_at or when
+        return original_fire(key, when)
+
+    bot_module.scheduler._on_fire = on_fire
+    result = {"size": size, "channels": channel_count, "simulated_minutes": minutes}
+
+    # --- Запис: всички графици + единични промени ---
+    now = bot_module.scheduler.now()
+    for i in range(size):
+        msg_id = f"msg-{i:07d}"
+        bot_module.active_messages[bot_module.schedule_key(GUILD_ID, msg_id)] = bot_module.Schedule(
+            id=msg_id,
+            message=msg_id,
+            interval=random.randint(5, 60),
+            repeat=0,
+            creator="bench",
+            status=bot_module.STATUS_ACTIVE,
+            channel_id=100000 + i % channel_count,
+            next_fire_at=now + 60 + random.uniform(0, 300),
+            guild_id=GUILD_ID
+        )
+    started = time.perf_counter()
+    bot_module.save_messages()
+    await bot_module.store.flush()
+    result["persist_all_seconds"] = time.perf_counter() - started
+
+    single = []
+    for i in random.sample(range(size), min(200, size)):
+        key = bot_module.schedule_key(GUILD_ID, f"msg-{i:07d}")
+        started = time.perf_counter()
+        bot_module.update_interval_value(key, bot_module.active_messages[key].interval)
+        await bot_module.store.flush()
+        single.append(time.perf_counter() - started)
+    result["persist_single_ms"] = {k: v * 1000 for k, v in summarize(single).items()}
+
+    # --- Старт: load_messages от хранилището ---
+    bot_module.active_messages.clear()
+    bot_module.guild_states.clear()
+    bot_module.scheduler.clear()
+    started = time.perf_counter()
+    await bot_module.load_messages()
+    result["startup_seconds"] = time.perf_counter() - started
+    result["loaded"] = len(bot_module.active_messages)
+
+    # --- Slash команди: create и list ---
+    create_times = []
+    for i in range(min(500, size)):
+        interaction = fake_interaction(bot_module)
+        channel = channels[100000 + i % channel_count]
+        started = time.perf_counter()
+        await bot_module.create.callback(interaction, message=f"created {i}", repeat=0, id=f"new-{i:05d}", interval=30, channel=channel)
+        create_times.append(time.perf_counter() - started)
+    result["create_ms"] = {k: v * 1000 for k, v in summarize(create_times).items()}
+
+    list_times = []
+    for _ in range(20):
+        interaction = fake_interaction(bot_module)
+        started = time.perf_counter()
+        await bot_module.list_messages.callback(interaction, None, None, None, None)
+        list_times.append(time.perf_counter() - started)
+    result["list_ms"] = {k: v * 1000 for k, v in summarize(list_times).items()}
+
+    # --- Работа на планировчика във виртуално време ---
+    stats.drift.clear()
+    stats.intended.clear()
+    bot_module.scheduler.start()
+    real_started = time.perf_counter()
+    await asyncio.sleep(minutes * 60)
+    real_elapsed = time.perf_counter() - real_started
+    bot_module.scheduler.stop()
+    bot_module.dispatcher.stop()
+
+    result["sends"] = stats.sends
+    result["rate_limited"] = stats.rate_limited
+    result["sends_per_second_virtual"] = stats.sends / (minutes * 60)
+    result["sends_per_second_real"] = stats.sends / real_elapsed if real_elapsed else 0.0
+    result["drift_seconds"] = summarize(stats.drift)
+    result["real_seconds"] = real_elapsed
+    await bot_module.store.flush()
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_single(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["MESSAGES_DB"] = os.path.join(tmp, "bench.db")
+        os.environ.pop("DISCORD_TOKEN", None)
+        os.environ.setdefault("STARTUP_SPREAD_SECONDS", "60")
+        loop = VirtualClockLoop()
+        try:
+            result = loop.run_until_complete(simulate(args.size, args.minutes, args.latency, args.seed))
+        finally:
+            loop.close()
+    sys.stdout.write("RESULT " + json.dumps(result) + "\n")
+
+
+def run_all(args) -> None:
+    results = []
+    for size in args.sizes:
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--size", str(size),
+            "--minutes", str(args.minutes), "--latency", str(args.latency), "--seed", str(args.seed)
+        ]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+        line = next((l for l in proc.stdout.splitlines() if l.startswith("RESULT ")), None)
+        if line is None:
+            print(proc.stdout[-2000:], proc.stderr[-4000:])
+            raise SystemExit(f"Сценарият за {size} графика се провали")
+        result = json.loads(line[len("RESULT "):])
+        results.append(result)
+        print(
+            f"n={size:<7} startup={result['startup_seconds']:6.2f}s  "
+            f"persist_all={result['persist_all_seconds']:6.2f}s  "
+            f"persist_p50={result['persist_single_ms']['p50']:6.2f}ms  "
+            f"sends/s(virt)={result['sends_per_second_virtual']:7.1f}  "
+            f"sends/s(real)={result['sends_per_second_real']:8.1f}  "
+            f"drift p50/p99={result['drift_seconds']['p50']:.3f}/{result['drift_seconds']['p99']:.3f}s  "
+            f"rss={result['peak_rss_mb']:.0f}MiB",
+            flush=True
+        )
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "params": {"minutes": args.minutes, "latency": args.latency, "seed": args.seed},
+        "results": results
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Резултати: {path}")
+
+    if args.baseline:
+        compare(args.baseline, report)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT).stdout.strip()
+    except OSError:
+        return ""
+
+
+COMPARED = [
+    ("startup_seconds", lambda r: r["startup_seconds"]),
+    ("persist_single_p50_ms", lambda r: r["persist_single_ms"]["p50"]),
+    ("create_p50_ms", lambda r: r["create_ms"]["p50"]),
+    ("list_p50_ms", lambda r: r["list_ms"]["p50"]),
+    ("drift_p99_s", lambda r: r["drift_seconds"]["p99"]),
+    ("sends_per_second_real", lambda r: r["sends_per_second_real"]),
+    ("peak_rss_mb", lambda r: r["peak_rss_mb"])
+]
+
+
+def compare(baseline_path: str, report: dict) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["size"]: r for r in json.load(f)["results"]}
+    print(f"🔍 Сравнение с {baseline_path}:")
+    for result in report["results"]:
+        old = baseline.get(result["size"])
+        if not old:
+            continue
+        for name, get in COMPARED:
+            before, after = get(old), get(result)
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"  n={result['size']:<7} {name:<24} {before:10.3f} -> {after:10.3f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк на bot.py с фалшив Discord и виртуален часовник")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--minutes", type=float, default=15.0, help="симулирани минути работа")
+    parser.add_argument("--latency", type=float, default=0.05, help="симулирана латентност на send (сек.)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="път за JSON резултата")
+    parser.add_argument("--baseline", help="предишен JSON резултат за сравнение")
+    args = parser.parse_args()
+    if args.size:
+        run_single(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,220 +4,985 @@ from discord.ext import commands
 from discord import app_commands
 import asyncio
 import json
-from typing import Optional
+import hashlib
+import functools
+import time
+import math
+import resource
+import io
+import tempfile
+import aiohttp
+from typing import Dict, List, Literal, Optional
+from zoneinfo import available_timezones
 from datetime import datetime
 
-import logging, sys
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-print("🚀 Стартирам Discord клиента...", flush=True)
+from scheduler import Scheduler
+from storage import SqliteStore
+from dispatcher import Reroute, SendDispatcher
+from cache import TTLCache
+from models import MAX_ERROR_LENGTH, STATUS_ACTIVE, STATUS_FAILED, STATUS_STOPPED, Schedule, schedule_key, split_key
+from metrics import Registry, monitor_event_loop, start_metrics_server
+from logs import setup_logging
+from cron import compile_cron, format_schedule_spec, parse_schedule_spec
+from guilds import GuildConfig, GuildState
+from cluster import ClusterMember
+from bulk import build_schedule, detect_format, iter_export, iter_rows, validate_schedule
+from webhooks import DELIVERY_WEBHOOK, WebhookPool, format_delivery_spec, parse_delivery_spec, validate_delivery
+
+import logging
+
+# === Логване ===
+# Записите минават през опашка и се форматират/пишат в отделна нишка.
+# LOG_LEVELS задава нива по логър ("discord.gateway=WARNING,..."), а
+# успешните изпращания (amb.send) се семплират с LOG_SEND_SAMPLE.
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    logger_levels=os.getenv("LOG_LEVELS", "discord=INFO,discord.gateway=WARNING,discord.http=WARNING"),
+    fmt=os.getenv("LOG_FORMAT", "json"),
+    sample_rates={"amb.send": float(os.getenv("LOG_SEND_SAMPLE", "0.01"))}
+)
+log = logging.getLogger("amb")
+send_log = logging.getLogger("amb.send")
+PROCESS_STARTED = time.monotonic()
+log.info("🚀 Стартирам Discord клиента...")
 
 # === КОНФИГУРАЦИЯ ===
 TOKEN = os.getenv("DISCORD_TOKEN")
+# GUILD_ID и DISCORD_CHANNEL_ID са от времето с един сървър: ползват се само при
+# миграцията на старите записи (стават настройки на този guild) - след това
+# всеки guild има собствен канал по подразбиране и роли (/config)
 CHANNEL_ID = int(os.getenv("DISCORD_CHANNEL_ID")) if os.getenv("DISCORD_CHANNEL_ID") else None
 GUILD_ID = int(os.getenv("GUILD_ID")) if os.getenv("GUILD_ID") else None
 SAVE_FILE = "active_messages.json"
-ALLOWED_ROLES = ["Admin", "Moderator"]
-print("🔍 Проверка на Environment Variables:")
-print("DISCORD_TOKEN:", "✅ намерен" if TOKEN else "❌ липсва")
-print("GUILD_ID:", GUILD_ID)
-print("DISCORD_CHANNEL_ID:", CHANNEL_ID)
+DB_FILE = os.getenv("MESSAGES_DB", "active_messages.db")
+# Роли по име за guild-ове без роли в /config
+ALLOWED_ROLES = [r.strip() for r in os.getenv("ALLOWED_ROLES", "Admin,Moderator").split(",") if r.strip()]
+# Максимален брой графици на guild (0 = без лимит), ако не е зададен с /config
+GUILD_QUOTA = int(os.getenv("GUILD_QUOTA", "0"))
+# Едновременни заявки за изпращане: общо (раздавани на кръг между guild-овете)
+# и по желание твърд лимит на guild (0 = без)
+SEND_MAX_IN_FLIGHT = int(os.getenv("SEND_MAX_IN_FLIGHT", "50"))
+GUILD_MAX_IN_FLIGHT = int(os.getenv("GUILD_MAX_IN_FLIGHT", "0"))
+# Лимит за изпращане на канал (Discord: 5 съобщения за 5 сек.)
+SEND_RATE = float(os.getenv("SEND_RATE", "1.0"))
+SEND_BURST = float(os.getenv("SEND_BURST", "5"))
+COALESCE_SENDS = os.getenv("COALESCE_SENDS", "0") == "1"
+# Преходни грешки (429, 5xx, timeout): до SEND_MAX_RETRIES повторения с
+# backoff до SEND_MAX_BACKOFF сек.; SEND_TIMEOUT - таймаут на една заявка.
+# След DEAD_LETTER_AFTER поредни неуспешни изпращания графикът отива в
+# dead-letter (0 = само при постоянни грешки)
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+SEND_MAX_BACKOFF = float(os.getenv("SEND_MAX_BACKOFF", "60"))
+SEND_TIMEOUT = float(os.getenv("SEND_TIMEOUT", "30"))
+DEAD_LETTER_AFTER = int(os.getenv("DEAD_LETTER_AFTER", "5"))
+# Графиците с delivery=webhook: собствен лимит на канал (webhook-ите имат
+# отделни rate limit-и от бота), обща HTTP сесия с до HTTP_POOL_SIZE връзки
+WEBHOOK_SEND_RATE = float(os.getenv("WEBHOOK_SEND_RATE", "2.5"))
+WEBHOOK_SEND_BURST = float(os.getenv("WEBHOOK_SEND_BURST", "5"))
+WEBHOOK_NAME = os.getenv("WEBHOOK_NAME", "AutoMessageBot")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+# Пропуснати изпращания при рестарт: skip / once / all
+CATCHUP_POLICY = os.getenv("CATCHUP_POLICY", "once")
+if CATCHUP_POLICY not in ("skip", "once", "all"):
+    CATCHUP_POLICY = "once"
+STARTUP_SPREAD_SECONDS = float(os.getenv("STARTUP_SPREAD_SECONDS", "60"))
+# При "all": пауза между наваксваните пропуснати слотове на един график
+CATCHUP_SPACING_SECONDS = float(os.getenv("CATCHUP_SPACING_SECONDS", "1"))
+# Часова зона за cron графици без изрично зададена (празно = UTC)
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE") or None
+LIST_PAGE_SIZE = 10
+# /import: редове на партида (един flush + едно вмъкване в планировчика)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Над този размер временните файлове за /import и /export отиват на диска
+SPOOL_MAX_BYTES = 1024 * 1024
+EMBED_MESSAGE_PREVIEW = 300
+EMBED_ERROR_PREVIEW = 80
+# Дял от лимита 6000 символа на съобщение за един embed от страница на /list
+EMBED_MAX_LENGTH = 6000 // LIST_PAGE_SIZE
+# Lean режим за големи guild-ове: без member chunking/кеш, каналите се
+# взимат при нужда през fetch_channel
+LEAN_MODE = os.getenv("LEAN_MODE", "0") == "1"
+ALLOWED_ROLE_IDS = {int(r) for r in os.getenv("ALLOWED_ROLE_IDS", "").split(",") if r.strip().isdigit()}
+CHANNEL_CACHE_SIZE = int(os.getenv("CHANNEL_CACHE_SIZE", "2048"))
+# Клъстерен режим: няколко процеса с обща база; графиците се делят по канал
+CLUSTER_WORKER_ID = os.getenv("CLUSTER_WORKER_ID") or None
+CLUSTER_LEASE_SECONDS = float(os.getenv("CLUSTER_LEASE_SECONDS", "15"))
+CLUSTER_HEARTBEAT_SECONDS = float(os.getenv("CLUSTER_HEARTBEAT_SECONDS", "5"))
+CLUSTER_POLL_SECONDS = float(os.getenv("CLUSTER_POLL_SECONDS", "1"))
+# Шардинг на gateway връзката (AutoShardedBot); SHARD_IDS - кои шардове са в този процес
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip().isdigit()] or None
+CHANNEL_CACHE_TTL = float(os.getenv("CHANNEL_CACHE_TTL", "600"))
+# Локален Prometheus endpoint (0 = изключен) и cProfile по заявка
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+PROFILING = os.getenv("PROFILING", "0") == "1"
+log.info(
+    "🔍 Проверка на Environment Variables",
+    extra={"token": "✅ намерен" if TOKEN else "❌ липсва", "guild_id": GUILD_ID, "channel_id": CHANNEL_ID, "lean_mode": LEAN_MODE}
+)
 
 # === Intents ===
 intents = discord.Intents.default()
 intents.message_content = True
-intents.members = True
+intents.members = not LEAN_MODE
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot_options = {}
+if SHARD_COUNT:
+    bot_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS}
+bot = (commands.AutoShardedBot if SHARD_COUNT else commands.Bot)(
+    command_prefix="!",
+    intents=intents,
+    # Командите са глобални, но имат смисъл само в сървър
+    allowed_contexts=app_commands.AppCommandContext(guild=True, dm_channel=False, private_channel=False),
+    member_cache_flags=discord.MemberCacheFlags.none() if LEAN_MODE else discord.MemberCacheFlags.from_intents(intents),
+    chunk_guilds_at_startup=not LEAN_MODE,
+    **bot_options
+)
 tree = bot.tree
 guild = discord.Object(id=GUILD_ID) if GUILD_ID else None
+# Всички заредени графици по ключ "<guild_id>:<id>" (същият ключ като в
+# хранилището и планировчика)
 active_messages = {}
+# Дялове по guild: настройки и индекси (канал, създател, статус, ID префикси)
+guild_states: Dict[int, GuildState] = {}
+embed_cache = {}
+channel_cache = TTLCache(maxsize=CHANNEL_CACHE_SIZE, ttl=CHANNEL_CACHE_TTL)
+allowed_role_cache = {}
+store = SqliteStore(DB_FILE)
+
+# === Метрики ===
+metrics_registry = Registry()
+scheduler_lag = metrics_registry.histogram("amb_scheduler_lag_seconds", "Закъснение на изпълнението спрямо планираното време")
+send_latency = metrics_registry.histogram("amb_send_latency_seconds", "Продължителност на channel.send", ["channel"])
+send_errors = metrics_registry.counter("amb_send_errors_total", "Неуспешни channel.send", ["channel"])
+send_retries = metrics_registry.counter("amb_send_retries_total", "Повторения след преходна грешка", ["channel"])
+dead_letters = metrics_registry.counter("amb_dead_letters_total", "Графици, преместени в dead-letter", ["channel"])
+webhook_latency = metrics_registry.histogram("amb_webhook_send_latency_seconds", "Продължителност на изпращане през webhook", ["channel"])
+webhook_fallbacks = metrics_registry.counter("amb_webhook_fallbacks_total", "Webhook изпращания, минали през channel.send", ["channel"])
+flush_duration = metrics_registry.histogram("amb_persistence_flush_seconds", "Продължителност на flush към хранилището")
+flush_records = metrics_registry.counter("amb_persistence_flushed_records_total", "Записани/изтрити редове")
+interaction_latency = metrics_registry.histogram("amb_interaction_latency_seconds", "Продължителност на обработката на interaction", ["handler", "outcome"])
+loop_block = metrics_registry.histogram("amb_event_loop_block_seconds", "Закъснение на event loop-а")
+
+def count_schedules() -> dict:
+    counts = {}
+    for msg in active_messages.values():
+        counts[(msg.status,)] = counts.get((msg.status,), 0) + 1
+    return counts
+
+metrics_registry.gauge("amb_schedules", "Брой графици по статус", ["status"], callback=count_schedules)
+
+def on_store_flush(duration: float, records: int) -> None:
+    flush_duration.observe(duration)
+    flush_records.inc(amount=records)
+
+store.on_flush = on_store_flush
+
+def timed_handler(handler):
+    # Мери самия handler с perf_counter (вкл. тези, които хвърлят грешка -
+    # outcome="error"). handler е име или функция (self, interaction) -> име.
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                name = handler if isinstance(handler, str) else handler(*args)
+                interaction_latency.observe(time.perf_counter() - started, name, outcome)
+        return wrapper
+    return decorator
+
+# === Guild-ове ===
+def guild_state(guild_id: int) -> GuildState:
+    state = guild_states.get(guild_id)
+    if state is None:
+        state = guild_states[guild_id] = GuildState(guild_id)
+    return state
+
+async def ensure_guild(guild_id: int) -> GuildState:
+    # Мързеливо зареждане на дяла при първата команда от guild-а - след
+    # миграцията на старите записи, иначе дялът би се заредил празен
+    state = guild_state(guild_id)
+    if not state.loaded:
+        await migration_done.wait()
+        async with state.lock:
+            if not state.loaded:
+                overdue = await load_guild(state)
+                spread_overdue(overdue, scheduler.now())
+    return state
+
+def default_channel_id(guild_id: Optional[int]) -> Optional[int]:
+    state = guild_states.get(guild_id)
+    return state.config.channel_id if state is not None else None
+
+def guild_quota(state: GuildState) -> int:
+    return state.config.quota if state.config.quota is not None else GUILD_QUOTA
+
+def schedule_channel(msg: Schedule) -> Optional[int]:
+    return msg.channel_id or default_channel_id(msg.guild_id)
+
+def channel_in_guild(channel, guild_id: int) -> bool:
+    return isinstance(channel, discord.TextChannel) and channel.guild.id == guild_id
 
 # === Помощни функции ===
-def has_permission(user: discord.Member) -> bool:
-    if user.guild_permissions.administrator:
+def allowed_role_ids(guild_id: int, guild_obj: Optional[discord.Guild]) -> frozenset:
+    # Ролите от /config имат предимство; иначе имената от ALLOWED_ROLES се
+    # превръщат в ID-та веднъж на guild
+    state = guild_states.get(guild_id)
+    if state is not None and state.config.role_ids:
+        return state.config.role_ids
+    if guild_obj is None:
+        return frozenset(ALLOWED_ROLE_IDS)
+    cached = allowed_role_cache.get(guild_obj.id)
+    if cached is None:
+        cached = frozenset(ALLOWED_ROLE_IDS | {r.id for r in guild_obj.roles if r.name in ALLOWED_ROLES})
+        allowed_role_cache[guild_obj.id] = cached
+    return cached
+
+async def has_permission(interaction: discord.Interaction) -> bool:
+    # Всяка команда минава оттук, затова тук се зарежда и дялът на guild-а.
+    # Правата идват директно от interaction payload-а, без member кеша.
+    if interaction.guild_id is None:
+        return False
+    await ensure_guild(interaction.guild_id)
+    if interaction.permissions.administrator:
         return True
-    for role in user.roles:
-        if role.name in ALLOWED_ROLES:
-            return True
-    return False
+    roles = getattr(interaction.user, "roles", None)
+    if not roles:
+        return False
+    allowed = allowed_role_ids(interaction.guild_id, interaction.guild)
+    return any(role.id in allowed for role in roles)
 
-def save_messages():
-    data = {}
-    for msg_id, msg in active_messages.items():
-        data[msg_id] = {
-            "message": msg.get("message"),
-            "interval": msg.get("interval"),
-            "repeat": msg.get("repeat"),
-            "id": msg.get("id"),
-            "creator": msg.get("creator"),
-            "status": msg.get("status", "active"),
-            "channel_id": msg.get("channel_id", None)
-        }
-    with open(SAVE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+async def resolve_channel(channel_id: Optional[int]):
+    if not channel_id:
+        return None
+    channel = bot.get_channel(channel_id) or channel_cache.get(channel_id)
+    if channel:
+        return channel
+    try:
+        channel = await bot.fetch_channel(channel_id)
+    except (discord.NotFound, discord.Forbidden):
+        return None
+    channel_cache.set(channel_id, channel)
+    return channel
+
+def index_entry(msg: Schedule) -> tuple:
+    return msg.id, msg.channel_id, msg.creator, msg.status
+
+def sync_guild_active(state: GuildState) -> None:
+    # Флагът в хранилището решава дали дялът се зарежда при старт
+    has_active = state.has_active
+    if has_active != state.active:
+        state.active = has_active
+        store.set_guild_active(state.guild_id, has_active)
+
+def save_message(key: str) -> None:
+    # Един ред на промяна; store групира поредните промени в един flush.
+    # Тук се обновяват и индексите - всички промени минават оттук.
+    msg = active_messages.get(key)
+    if msg is None:
+        guild_id, msg_id = split_key(key)
+        state = guild_state(guild_id)
+        embed_cache.pop(key, None)
+        state.index.remove(msg_id)
+        store.delete(key)
+    else:
+        state = guild_state(msg.guild_id)
+        state.index.update(*index_entry(msg))
+        store.upsert(key, msg.to_storage())
+    sync_guild_active(state)
+
+def save_runtime(key: str, notify: bool = False) -> None:
+    # Запис от изпращането (фаза, брой изпращания, грешки) в процеса
+    # собственик: условен UPDATE - изтрит или променен от друга команда ред
+    # не се връща. Другите процеси го виждат само с notify (статус/здраве).
+    msg = active_messages.get(key)
+    if msg is None:
+        return
+    if notify:
+        state = guild_state(msg.guild_id)
+        state.index.update(*index_entry(msg))
+        sync_guild_active(state)
+    store.update_runtime(key, msg.to_storage(), notify)
 
-def get_message_data(msg_id: str) -> Optional[dict]:
-    return active_messages.get(msg_id)
+def save_messages():
+    for key in active_messages:
+        save_message(key)
 
-def get_stored_message_content(msg_id: str) -> str:
-    data = get_message_data(msg_id)
-    return data.get("message", "") if data else ""
+def save_many(msgs: List[Schedule]) -> None:
+    # Масов запис (напр. /import) - всички редове в една партида на store
+    by_guild = {}
+    for msg in msgs:
+        by_guild.setdefault(msg.guild_id, []).append(msg)
+    for guild_id, group in by_guild.items():
+        state = guild_state(guild_id)
+        state.index.update_many(index_entry(msg) for msg in group)
+        sync_guild_active(state)
+    store.upsert_many((msg.key, msg.to_storage()) for msg in msgs)
 
-def get_stored_interval(msg_id: str) -> Optional[int]:
-    data = get_message_data(msg_id)
-    return data.get("interval") if data else None
+def get_message_data(key: str) -> Optional[Schedule]:
+    return active_messages.get(key)
 
-def get_stored_repeat(msg_id: str) -> Optional[int]:
-    data = get_message_data(msg_id)
-    return data.get("repeat") if data else None
+def update_message_content_value(key: str, new_content: str) -> None:
+    data = get_message_data(key)
+    if not data:
+        raise KeyError(key)
+    data.message = new_content
+    save_message(key)
 
-def get_stored_channel_id(msg_id: str) -> Optional[int]:
-    data = get_message_data(msg_id)
-    return data.get("channel_id") if data else None
+def update_interval_value(key: str, new_interval: int) -> None:
+    data = get_message_data(key)
+    if not data:
+        raise KeyError(key)
+    data.interval = new_interval
+    save_message(key)
 
-def update_message_content_value(msg_id: str, new_content: str) -> None:
-    data = get_message_data(msg_id)
+def update_cron_value(key: str, cron: Optional[str], tz_name: Optional[str]) -> None:
+    data = get_message_data(key)
     if not data:
-        raise KeyError(msg_id)
-    data["message"] = new_content
-    save_messages()
+        raise KeyError(key)
+    data.cron = cron
+    data.timezone = tz_name if cron else None
+    save_message(key)
 
-def update_interval_value(msg_id: str, new_interval: int) -> None:
-    data = get_message_data(msg_id)
+def update_repeat_value(key: str, new_repeat: int) -> None:
+    data = get_message_data(key)
     if not data:
-        raise KeyError(msg_id)
-    data["interval"] = new_interval
-    save_messages()
+        raise KeyError(key)
+    data.repeat = new_repeat
+    save_message(key)
 
-def update_repeat_value(msg_id: str, new_repeat: int) -> None:
-    data = get_message_data(msg_id)
+def update_channel_value(key: str, new_channel_id: Optional[int]) -> None:
+    data = get_message_data(key)
     if not data:
-        raise KeyError(msg_id)
-    data["repeat"] = new_repeat
-    save_messages()
+        raise KeyError(key)
+    data.channel_id = new_channel_id
+    save_message(key)
 
-def update_channel_value(msg_id: str, new_channel_id: Optional[int]) -> None:
-    data = get_message_data(msg_id)
+def update_delivery_value(key: str, delivery: Optional[str], username: Optional[str], avatar_url: Optional[str]) -> None:
+    data = get_message_data(key)
     if not data:
-        raise KeyError(msg_id)
-    data["channel_id"] = new_channel_id
-    save_messages()
+        raise KeyError(key)
+    data.delivery = delivery
+    data.username = username
+    data.avatar_url = avatar_url
+    save_message(key)
 
-# === Task за автоматични съобщения ===
-async def restart_message_task(msg_id: str, start_immediately: bool = True):
-    msg_data = active_messages.get(msg_id)
-    if not msg_data:
-        return
+# === Планиране на автоматичните съобщения ===
+async def deliver_message(channel_id: int, content: str):
+    started = time.perf_counter()
+    try:
+        channel = await resolve_channel(channel_id)
+        if not channel:
+            raise LookupError(f"канал {channel_id} не е намерен")
+        await channel.send(content)
+    except Exception:
+        send_errors.inc(channel_id)
+        raise
+    finally:
+        send_latency.observe(time.perf_counter() - started, channel_id)
+
+# === Изпращане през webhook ===
+# Една aiohttp сесия за целия процес (keep-alive към discord.com) - ползва се
+# от webhook-ите и от свалянето на файлове за /import.
+_http_session: Optional[aiohttp.ClientSession] = None
 
-    if msg_data.get("task"):
+def http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300))
+    return _http_session
+
+webhooks = WebhookPool(store, resolve_channel, bot.fetch_webhook, http_session, name=WEBHOOK_NAME, maxsize=CHANNEL_CACHE_SIZE)
+
+async def deliver_webhook(channel_id: int, content: str, identity: Optional[tuple] = None):
+    username, avatar_url = identity or (None, None)
+    webhook = await webhooks.get(channel_id)
+    if webhook is not None:
+        started = time.perf_counter()
         try:
-            msg_data["task"].cancel()
+            await webhook.send(
+                content,
+                username=username or discord.utils.MISSING,
+                avatar_url=avatar_url or discord.utils.MISSING
+            )
+            return
+        except discord.NotFound:
+            # Webhook-ът е изтрит ръчно - при следващото изпращане се създава нов
+            log.warning("⚠️ Webhook-ът е изтрит - изпращам през бота", extra={"channel_id": channel_id})
+            await webhooks.forget(channel_id)
         except Exception:
-            pass
+            send_errors.inc(channel_id)
+            raise
+        finally:
+            webhook_latency.observe(time.perf_counter() - started, channel_id)
+    # Без webhook (няма право, не е текстов канал или е изтрит) - през бота,
+    # с token bucket-а на бота за канала, а не с този на webhook-ите
+    webhook_fallbacks.inc(channel_id)
+    raise Reroute(dispatcher)
 
-    if msg_data.get("status") != "active":
-        msg_data["task"] = None
-        return
+# === Надеждност на изпращането ===
+# Диспечерът повтаря преходните грешки сам; тук стигат само окончателните
+# откази. Постоянна грешка (няма достъп, несъществуващ канал) или твърде
+# много поредни неуспехи = dead-letter (статус failed с причината), докато
+# /requeue или ▶️ Start не го пуснат отново. Иначе графикът продължава и
+# само се отбелязва като degraded.
+def error_reason(error: Exception) -> str:
+    if isinstance(error, discord.HTTPException):
+        reason = f"{error.status} {error.text or getattr(error.response, 'reason', '')}"
+    else:
+        reason = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+    return reason[:MAX_ERROR_LENGTH]
+
+def dead_letter(key: str, msg_data: Schedule, reason: str) -> None:
+    scheduler.remove(key)
+    msg_data.status = STATUS_FAILED
+    msg_data.last_error = reason
+    msg_data.next_fire_at = None
+    save_runtime(key, notify=True)
+    dead_letters.inc(msg_data.channel_id)
+    log.error(f"☠️ Графикът е преместен в dead-letter: {reason}", extra={"schedule_id": key, "channel_id": msg_data.channel_id})
+
+# ID-тата в диспечера са (ключ, последно изпращане) - виж on_schedule_fire
+def on_send_failed(sends: list, channel_id: int, error: Exception, permanent: bool) -> None:
+    reason = error_reason(error)
+    for key, last in sends:
+        msg_data = active_messages.get(key)
+        if msg_data is None or msg_data.status == STATUS_FAILED:
+            continue
+        # Изпращането не е станало - не се брои към repeat
+        msg_data.sent_count = max(0, msg_data.sent_count - 1)
+        msg_data.failures += 1
+        # Изгубено е последното изпращане и графикът не е пуснат отново след това
+        finished = last and msg_data.status == STATUS_STOPPED and msg_data.next_fire_at is None
+        if permanent or finished or (DEAD_LETTER_AFTER and msg_data.failures >= DEAD_LETTER_AFTER):
+            dead_letter(key, msg_data, reason)
+            continue
+        msg_data.last_error = reason
+        save_runtime(key, notify=True)
+        log.warning(
+            f"⚠️ Неуспешно изпращане ({msg_data.failures} поредни): {reason}",
+            extra={"schedule_id": key, "channel_id": channel_id}
+        )
+
+def on_send_retry(sends: list, channel_id: int, error: Exception, attempt: int) -> None:
+    send_retries.inc(channel_id)
+    log.warning(
+        f"🔁 Преходна грешка, опит {attempt}/{SEND_MAX_RETRIES}: {error_reason(error)}",
+        extra={"schedule_ids": [key for key, _ in sends], "channel_id": channel_id}
+    )
+
+first_send_at = None
+
+def on_message_sent(sends: list, channel_id: int) -> None:
+    global first_send_at
+    if first_send_at is None:
+        first_send_at = time.monotonic()
+        log.info(f"⏱️ Първо планирано изпращане {first_send_at - PROCESS_STARTED:.2f} сек. след старта на процеса")
+    for key, _ in sends:
+        msg_data = active_messages.get(key)
+        if msg_data is not None and msg_data.failures and msg_data.status != STATUS_FAILED:
+            # Успешно изпращане след грешки - графикът е отново здрав
+            msg_data.failures = 0
+            msg_data.last_error = None
+            save_runtime(key, notify=True)
+    if send_log.isEnabledFor(logging.INFO):
+        for key, _ in sends:
+            send_log.info("📨 Изпратено", extra={"schedule_id": key, "channel_id": channel_id})
+
+dispatcher = SendDispatcher(
+    deliver_message,
+    rate=SEND_RATE,
+    burst=SEND_BURST,
+    coalesce=COALESCE_SENDS,
+    max_in_flight=SEND_MAX_IN_FLIGHT,
+    group_in_flight=GUILD_MAX_IN_FLIGHT,
+    max_retries=SEND_MAX_RETRIES,
+    max_backoff=SEND_MAX_BACKOFF,
+    timeout=SEND_TIMEOUT,
+    on_sent=on_message_sent,
+    on_failed=on_send_failed,
+    on_retry=on_send_retry
+)
+
+# Отделни token bucket-и на канал за webhook графиците
+webhook_dispatcher = SendDispatcher(
+    deliver_webhook,
+    rate=WEBHOOK_SEND_RATE,
+    burst=WEBHOOK_SEND_BURST,
+    coalesce=COALESCE_SENDS,
+    max_in_flight=SEND_MAX_IN_FLIGHT,
+    group_in_flight=GUILD_MAX_IN_FLIGHT,
+    max_retries=SEND_MAX_RETRIES,
+    max_backoff=SEND_MAX_BACKOFF,
+    timeout=SEND_TIMEOUT,
+    on_sent=on_message_sent,
+    on_failed=on_send_failed,
+    on_retry=on_send_retry
+)
+
+def next_slot_after(start: float, step: float, now: float) -> float:
+    # Първият слот start + k*step, който е строго след now
+    if start > now:
+        return start
+    return start + (math.floor((now - start) / step) + 1) * step
 
-    target_channel_id = msg_data.get("channel_id") or CHANNEL_ID
-    channel = bot.get_channel(target_channel_id) if target_channel_id else None
+def next_fire_time(msg_data: Schedule, phase: float) -> Optional[float]:
+    # Следващото изпращане е закотвено към планираната фаза, не към края на send
+    # (when може да е разсрочено при рестарт, next_fire_at пази истинската фаза).
+    # None = еднократно съобщение или cron израз без следващо съвпадение.
+    now = scheduler.now()
+    if msg_data.cron:
+        cron = compile_cron(msg_data.cron, msg_data.timezone)
+        return cron.next_after(phase if CATCHUP_POLICY == "all" else max(phase, now))
+    if msg_data.interval <= 0:
+        return None
+    step = msg_data.interval * 60
+    next_at = phase + step
+    if CATCHUP_POLICY != "all":
+        next_at = next_slot_after(next_at, step, now)
+    return next_at
+
+def on_schedule_fire(key: str, when: float) -> Optional[float]:
+    msg_data = active_messages.get(key)
+    if not msg_data or msg_data.status != STATUS_ACTIVE:
+        return None
+    scheduler_lag.observe(scheduler.now() - when)
+
+    repeat = msg_data.repeat
+    if repeat != 0 and msg_data.sent_count >= repeat:
+        msg_data.status = STATUS_STOPPED
+        save_runtime(key, notify=True)
+        return None
+
+    msg_data.sent_count = msg_data.sent_count + 1
+    next_at = next_fire_time(msg_data, msg_data.next_fire_at or when)
+    last = next_at is None or (repeat != 0 and msg_data.sent_count >= repeat)
+
+    # Групата в диспечера е guild-ът - лимит на едновременните заявки на guild.
+    # ID-то носи и дали това е последното изпращане (за dead-letter при отказ)
+    if msg_data.delivery == DELIVERY_WEBHOOK:
+        webhook_dispatcher.submit(
+            schedule_channel(msg_data), msg_data.message, (key, last), msg_data.guild_id,
+            identity=(msg_data.username, msg_data.avatar_url)
+        )
+    else:
+        dispatcher.submit(schedule_channel(msg_data), msg_data.message, (key, last), msg_data.guild_id)
+
+    if last:
+        msg_data.status = STATUS_STOPPED
+        msg_data.next_fire_at = None
+        save_runtime(key, notify=True)
+        return None
+
+    msg_data.next_fire_at = next_at
+    save_runtime(key)
+    now = scheduler.now()
+    if next_at <= now:
+        # "all": пропуснат слот. Фазата остава в next_fire_at, а изпращането
+        # се пуска след CATCHUP_SPACING_SECONDS - не всички наведнъж в run_due
+        return now + CATCHUP_SPACING_SECONDS
+    return next_at
+
+scheduler = Scheduler(on_schedule_fire)
+
+async def channel_available(key: str, msg_data: Schedule) -> bool:
+    channel_id = schedule_channel(msg_data)
+    channel = await resolve_channel(channel_id)
     if not channel:
-        msg_data["status"] = "stopped"
-        msg_data["task"] = None
-        save_messages()
+        dead_letter(key, msg_data, f"Unknown Channel: канал {channel_id} не е намерен")
+        return False
+    return True
+
+def owns_schedule(msg_data: Schedule) -> bool:
+    return cluster is None or cluster.owns(schedule_channel(msg_data))
+
+def schedule_local(key: str, when: float) -> None:
+    # В клъстер графикът се пуска само в процеса собственик на канала
+    if owns_schedule(active_messages[key]):
+        scheduler.schedule(key, when)
+    else:
+        scheduler.remove(key)
+
+async def restart_message_task(key: str, start_immediately: bool = True):
+    msg_data = active_messages.get(key)
+    if not msg_data:
         return
 
-    async def task_func():
-        count = 0
-        repeat = msg_data.get("repeat", 0)
-        interval = msg_data.get("interval", 0)
-        if not start_immediately and interval > 0:
-            await asyncio.sleep(interval * 60)
+    if msg_data.status != STATUS_ACTIVE:
+        scheduler.remove(key)
+        return
 
-        while True:
-            if repeat != 0 and count >= repeat:
-                msg_data["status"] = "stopped"
-                break
+    if not await channel_available(key, msg_data):
+        return
 
-            try:
-                await channel.send(msg_data.get("message", ""))
-            except Exception as e:
-                print(f"❌ Грешка при пращане на съобщение ({msg_id}): {e}")
-                break
+    interval = msg_data.interval
+    now = scheduler.now()
+    if msg_data.cron:
+        # Cron графикът никога не тръгва "веднага" - чака първото съвпадение
+        next_at = compile_cron(msg_data.cron, msg_data.timezone).next_after(now)
+    elif not start_immediately and interval > 0:
+        next_at = now + interval * 60
+    else:
+        next_at = now
+    msg_data.sent_count = 0
+    msg_data.next_fire_at = next_at
+    save_message(key)
+    schedule_local(key, next_at)
 
-            count += 1
-            if interval <= 0:
-                msg_data["status"] = "stopped"
-                break
+def resume_message(key: str, now: float) -> bool:
+    # Връща True, ако графикът е просрочен и трябва да бъде разсрочен.
+    # Каналът не се проверява тук - взима се при първото изпращане.
+    msg_data = active_messages[key]
+    if msg_data.status != STATUS_ACTIVE or not owns_schedule(msg_data):
+        return False
 
-            try:
-                await asyncio.sleep(interval * 60)
-            except asyncio.CancelledError:
-                break
+    next_at = msg_data.next_fire_at
+    if next_at is not None and next_at > now:
+        scheduler.schedule(key, next_at)
+        return False
+    if next_at is None and msg_data.cron:
+        # Без фаза (напр. офлайн импорт през bulk.py): cron графикът чака
+        # следващото съвпадение, както при /create
+        next_at = compile_cron(msg_data.cron, msg_data.timezone).next_after(now)
+        if next_at is None:
+            msg_data.status = STATUS_STOPPED
+            save_runtime(key, notify=True)
+            return False
+        msg_data.next_fire_at = next_at
+        save_runtime(key)
+        scheduler.schedule(key, next_at)
+        return False
+    if next_at is None:
+        # Стар запис без фаза - третира се като дължим сега
+        msg_data.next_fire_at = now
+        return True
+
+    if CATCHUP_POLICY == "skip":
+        next_at = next_fire_time(msg_data, next_at)
+        if next_at is None:
+            # Еднократното съобщение е пропуснато
+            msg_data.status = STATUS_STOPPED
+            msg_data.next_fire_at = None
+            save_runtime(key, notify=True)
+            return False
+        msg_data.next_fire_at = next_at
+        save_runtime(key)
+        scheduler.schedule(key, msg_data.next_fire_at)
+        return False
+    # "once" и "all": пуска се веднага (разсрочено), а on_schedule_fire решава
+    # дали да навакса останалите пропуснати слотове
+    return True
+
+# === Зареждане ===
+# При старт се четат само дяловете на guild-овете с активни графици (флаг в
+# таблицата guilds); останалите - при първата команда (ensure_guild).
+SCHEMA_META_KEY = "schema"
+SCHEMA_VERSION = "guilds-1"
+# Вдига се от load_messages след миграцията (или веднага, ако не е нужна)
+migration_done = asyncio.Event()
+
+async def load_guild(state: GuildState) -> List[str]:
+    # Връща просрочените ключове - извикващият ги разсрочва
+    payloads = await store.load_guild(state.guild_id)
+    state.config = GuildConfig.from_storage(await store.get_guild_config(state.guild_id))
+    data = {key: Schedule.from_storage(payload) for key, payload in payloads.items()}
+    active_messages.update(data)
+    state.index.rebuild(index_entry(msg) for msg in data.values())
+    state.loaded = True
+    sync_guild_active(state)
+
+    now = scheduler.now()
+    return [key for key in data if resume_message(key, now)]
+
+async def legacy_guild_id(channel_id: Optional[int], channels: dict) -> int:
+    # Стар запис без guild: GUILD_ID, иначе guild-ът на канала му (0 = неизвестен)
+    if GUILD_ID:
+        return GUILD_ID
+    if channel_id not in channels:
+        channel = await resolve_channel(channel_id)
+        channels[channel_id] = channel.guild.id if getattr(channel, "guild", None) else 0
+    return channels[channel_id]
 
-        msg_data["task"] = None
-        save_messages()
+async def migrate_to_guilds() -> None:
+    # Еднократно: записи отпреди multi-guild (и стария JSON файл) получават
+    # guild и ключ "<guild_id>:<id>"; DISCORD_CHANNEL_ID става канал по
+    # подразбиране на guild-а си
+    legacy = []
+    payloads = await store.load_all()
+    for key, payload in payloads.items():
+        msg = Schedule.from_storage(payload)
+        if msg.guild_id is None:
+            legacy.append((key, msg))
+    if not payloads and os.path.exists(SAVE_FILE):
+        with open(SAVE_FILE, "r", encoding="utf-8") as f:
+            legacy = [(None, Schedule.from_dict(msg)) for msg in json.load(f).values()]
+        log.info(f"📦 Мигрирани {len(legacy)} съобщения от {SAVE_FILE} към {DB_FILE}.")
 
-    msg_data["task"] = asyncio.create_task(task_func())
-    save_messages()
+    channels = {}
+    unknown = 0
+    for old_key, msg in legacy:
+        msg.channel_id = msg.channel_id or CHANNEL_ID
+        msg.guild_id = await legacy_guild_id(msg.channel_id, channels)
+        unknown += not msg.guild_id
+        if old_key is not None:
+            store.delete(old_key)
+        store.upsert(msg.key, msg.to_storage())
+        if msg.status == STATUS_ACTIVE:
+            store.set_guild_active(msg.guild_id, True)
+
+    default_guild = await legacy_guild_id(CHANNEL_ID, channels) if CHANNEL_ID else None
+    if default_guild and await store.get_guild_config(default_guild) is None:
+        await store.set_guild_config(default_guild, GuildConfig(channel_id=CHANNEL_ID).to_storage())
+    await store.flush()
+    await store.set_meta(SCHEMA_META_KEY, SCHEMA_VERSION)
+    if legacy:
+        log.info(f"📦 {len(legacy)} записа са мигрирани към ключове по guild.", extra={"unknown_guild": unknown})
 
 async def load_messages():
-    if not os.path.exists(SAVE_FILE):
-        return
-    with open(SAVE_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    for msg_id, msg in data.items():
-        active_messages[msg_id] = msg
-        active_messages[msg_id]["task"] = None
-        await restart_message_task(msg_id, start_immediately=True)
-
-def build_info_embed(msg_data: dict) -> discord.Embed:
-    status = msg_data.get("status", "unknown")
-    color = discord.Color.green() if status == "active" else discord.Color.red()
-    repeat_display = "∞" if msg_data.get("repeat") == 0 else str(msg_data.get("repeat"))
-    channel_id = msg_data.get("channel_id")
+    try:
+        if await store.get_meta(SCHEMA_META_KEY) != SCHEMA_VERSION:
+            await migrate_to_guilds()
+    finally:
+        # И при грешка - командите не трябва да чакат завинаги
+        migration_done.set()
+
+    overdue = []
+    for guild_id in await store.active_guilds():
+        state = guild_state(guild_id)
+        state.active = True
+        async with state.lock:
+            if not state.loaded:
+                overdue.extend(await load_guild(state))
+    spread_overdue(overdue, scheduler.now())
+
+def spread_overdue(overdue: List[str], now: float) -> None:
+    # Просрочените се разпределят равномерно в прозореца, а не всички наведнъж
+    for i, key in enumerate(overdue):
+        scheduler.schedule(key, now + STARTUP_SPREAD_SECONDS * i / len(overdue))
+    if overdue:
+        log.info(f"⏱️ {len(overdue)} просрочени съобщения се разпределят в {STARTUP_SPREAD_SECONDS:.0f} сек. (политика: {CATCHUP_POLICY}).")
+
+# === Клъстер ===
+# Промени от другите процеси: презареждат се от базата без запис обратно
+# (иначе всяка промяна би обикаляла клъстера безкрайно).
+def reload_message(state: GuildState, key: str, msg_id: str, payload: Optional[str]) -> Optional[Schedule]:
+    embed_cache.pop(key, None)
+    if payload is None:
+        active_messages.pop(key, None)
+        state.index.remove(msg_id)
+        scheduler.remove(key)
+        return None
+    msg = Schedule.from_storage(payload)
+    active_messages[key] = msg
+    state.index.update(*index_entry(msg))
+    return msg
+
+def apply_remote_change(state: GuildState, key: str, msg_id: str, payload: Optional[str], now: float) -> None:
+    msg = reload_message(state, key, msg_id, payload)
+    if msg is None:
+        return
+    if msg.status != STATUS_ACTIVE or not owns_schedule(msg):
+        scheduler.remove(key)
+    elif scheduler.next_fire(key) != msg.next_fire_at:
+        scheduler.schedule(key, max(msg.next_fire_at or now, now))
+
+async def apply_after_load(guild_id: int, payloads: dict) -> None:
+    await ensure_guild(guild_id)
+    now = scheduler.now()
+    for key, payload in payloads.items():
+        apply_remote_change(guild_states[guild_id], key, split_key(key)[1], payload, now)
+
+async def reload_guild_config(state: GuildState) -> None:
+    state.config = GuildConfig.from_storage(await store.get_guild_config(state.guild_id))
+    allowed_role_cache.pop(state.guild_id, None)
+
+def on_cluster_changes(payloads: dict) -> None:
+    now = scheduler.now()
+    deferred = {}
+    for key, payload in payloads.items():
+        guild_id, msg_id = split_key(key)
+        state = guild_states.get(guild_id)
+        if not msg_id:
+            # Ключ без ID = променени настройки на guild
+            if state is not None and state.loaded:
+                asyncio.create_task(reload_guild_config(state))
+            continue
+        if state is None or not state.loaded:
+            # Незареден дял: зарежда се само заради активен график, който
+            # този процес може да трябва да изпраща
+            if state is not None or (payload is not None and Schedule.from_storage(payload).active):
+                deferred.setdefault(guild_id, {})[key] = payload
+            continue
+        apply_remote_change(state, key, msg_id, payload, now)
+    for guild_id, changes in deferred.items():
+        asyncio.create_task(apply_after_load(guild_id, changes))
+
+async def on_cluster_rebalance() -> None:
+    # Нов състав: спираме графиците, които вече са на друг процес, и пускаме
+    # поетите (просрочените - разсрочено). Фазата и броят изпращания на
+    # поетите са в базата - предишният собственик ги пише извън журнала,
+    # затова се презареждат преди пускане.
+    taken = []
+    for key, msg in active_messages.items():
+        if not owns_schedule(msg):
+            scheduler.remove(key)
+        elif msg.active and key not in scheduler:
+            taken.append(key)
+    if not taken:
+        return
+    payloads = await store.load_many(taken)
+    now = scheduler.now()
+    overdue = []
+    for key in taken:
+        guild_id, msg_id = split_key(key)
+        msg = reload_message(guild_state(guild_id), key, msg_id, payloads.get(key))
+        if msg is not None and key not in scheduler and resume_message(key, now):
+            overdue.append(key)
+    spread_overdue(overdue, now)
+
+cluster = ClusterMember(
+    store,
+    CLUSTER_WORKER_ID,
+    on_changes=on_cluster_changes,
+    on_rebalance=on_cluster_rebalance,
+    lease=CLUSTER_LEASE_SECONDS,
+    heartbeat_interval=CLUSTER_HEARTBEAT_SECONDS,
+    poll_interval=CLUSTER_POLL_SECONDS
+) if CLUSTER_WORKER_ID else None
+
+def shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def build_info_embed(msg_data: Schedule) -> discord.Embed:
+    status = msg_data.status
+    if status == STATUS_FAILED:
+        color = discord.Color.dark_red()
+    else:
+        color = discord.Color.green() if status == STATUS_ACTIVE else discord.Color.red()
+    repeat_display = "∞" if msg_data.repeat == 0 else str(msg_data.repeat)
+    channel_id = msg_data.channel_id
     channel_mention = f"<#{channel_id}>" if channel_id else "—"
 
-    embed = discord.Embed(title=f"🆔 {msg_data.get('id')} ({status})", color=color)
-    embed.add_field(name="Message", value=msg_data.get("message", "-"), inline=False)
-    embed.add_field(name="Interval", value=f"{msg_data.get('interval', '-') } мин", inline=True)
+    # Съкращаваме, за да се съберат 10 embed-а в лимита от 6000 символа на съобщение
+    message_preview = shorten(msg_data.message or "-", EMBED_MESSAGE_PREVIEW)
+    last_error = shorten(msg_data.last_error or "-", EMBED_ERROR_PREVIEW)
+
+    embed = discord.Embed(title=f"🆔 {str(msg_data.id)[:80]} ({status})", color=color)
+    embed.add_field(name="Message", value=message_preview, inline=False)
+    if msg_data.cron:
+        embed.add_field(name="Cron", value=f"`{msg_data.cron}` ({msg_data.timezone or 'UTC'})", inline=True)
+    else:
+        embed.add_field(name="Interval", value=f"{msg_data.interval} мин", inline=True)
     embed.add_field(name="Repeat", value=repeat_display, inline=True)
-    embed.add_field(name="Creator", value=msg_data.get("creator", "-"), inline=False)
+    embed.add_field(name="Creator", value=msg_data.creator or "-", inline=False)
     embed.add_field(name="Channel", value=channel_mention, inline=False)
+    if msg_data.delivery == DELIVERY_WEBHOOK:
+        embed.add_field(name="Delivery", value=f"🪝 webhook ({msg_data.username or WEBHOOK_NAME})", inline=False)
+    health = msg_data.health
+    if health == "dead":
+        embed.add_field(name="Health", value=f"☠️ dead-letter: {last_error}\n(/requeue след оправяне на канала)", inline=False)
+    elif health == "degraded":
+        embed.add_field(name="Health", value=f"⚠️ {msg_data.failures} неуспешни изпращания: {last_error}", inline=False)
+    else:
+        embed.add_field(name="Health", value="✅ OK", inline=True)
+    # Дълъг cron, име на webhook и грешка заедно - остатъкът се взима от текста
+    overflow = len(embed) - EMBED_MAX_LENGTH
+    if overflow > 0:
+        embed.set_field_at(0, name="Message", value=shorten(message_preview, max(1, len(message_preview) - overflow)), inline=False)
     embed.timestamp = datetime.utcnow()
     return embed
 
+def embed_signature(msg_data: Schedule) -> tuple:
+    return (
+        msg_data.id,
+        msg_data.status,
+        msg_data.message,
+        msg_data.interval,
+        msg_data.repeat,
+        msg_data.creator,
+        msg_data.channel_id,
+        msg_data.cron,
+        msg_data.timezone,
+        msg_data.delivery,
+        msg_data.username,
+        msg_data.failures,
+        msg_data.last_error
+    )
+
+def get_info_embed(msg_data: Schedule) -> discord.Embed:
+    # Кешът се инвалидира само когато се промени някое от показваните полета
+    key = msg_data.key
+    signature = embed_signature(msg_data)
+    cached = embed_cache.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    embed = build_info_embed(msg_data)
+    embed_cache[key] = (signature, embed)
+    return embed
+
+def filter_messages(
+    guild_id: int,
+    status: Optional[str] = None,
+    channel_id: Optional[int] = None,
+    creator: Optional[str] = None,
+    prefix: Optional[str] = None
+) -> list:
+    # ID-тата в дяла на guild-а (без префикса на ключа)
+    state = guild_states.get(guild_id)
+    if state is None:
+        return []
+    return state.index.query(status, channel_id, creator, prefix)
+
 # === Edit Modal с Channel ID предварително попълнено ===
 class EditModal(discord.ui.Modal):
-    def __init__(self, msg_id: str, guild: discord.Guild):
-        super().__init__(title="Edit Message")
-        self.msg_id = msg_id
+    def __init__(self, key: str, guild: discord.Guild):
+        super().__init__(title="Edit Message", timeout=600)
+        self.key = key
         self.guild = guild
 
-        self.content_input = discord.ui.TextInput(label="Message", default=get_stored_message_content(msg_id)[:1900])
-        self.interval_input = discord.ui.TextInput(label="Interval (minutes)", default=str(get_stored_interval(msg_id) or 0))
-        self.repeat_input = discord.ui.TextInput(label="Repeat count (0=∞)", default=str(get_stored_repeat(msg_id) or 0))
+        msg = get_message_data(key)
+        self.content_input = discord.ui.TextInput(label="Message", default=msg.message[:1900])
+        # Едно поле за интервал в минути или cron ("CRON_TZ=Europe/Sofia 0 9 * * 1-5")
+        self.interval_input = discord.ui.TextInput(
+            label="Interval (minutes) or cron",
+            default=format_schedule_spec(msg.interval, msg.cron, msg.timezone)
+        )
+        self.repeat_input = discord.ui.TextInput(label="Repeat count (0=∞)", default=str(msg.repeat))
         
         # ✅ Предварително попълване с текущ канал (ID)
-        current_channel_id = get_stored_channel_id(msg_id) or CHANNEL_ID or ""
+        current_channel_id = schedule_channel(msg) or ""
         self.channel_input = discord.ui.TextInput(label="Channel (ID)", default=str(current_channel_id))
+        # "bot", "webhook" или "webhook: име | https://.../avatar.png"
+        self.delivery_input = discord.ui.TextInput(
+            label="Delivery (bot | webhook: име | avatar URL)",
+            default=format_delivery_spec(msg.delivery, msg.username, msg.avatar_url),
+            required=False,
+            max_length=700
+        )
 
         self.add_item(self.content_input)
         self.add_item(self.interval_input)
         self.add_item(self.repeat_input)
         self.add_item(self.channel_input)
+        self.add_item(self.delivery_input)
 
+    @timed_handler("modal:edit")
     async def on_submit(self, interaction: discord.Interaction):
-        update_message_content_value(self.msg_id, self.content_input.value)
-        update_interval_value(self.msg_id, int(self.interval_input.value))
-        update_repeat_value(self.msg_id, int(self.repeat_input.value))
-
+        # Първо се проверяват всички полета - при грешка нищо не се променя
         channel_value = self.channel_input.value.strip()
         new_channel_id = None
         if channel_value.isdigit():
             new_channel_id = int(channel_value)
-            channel_obj = self.guild.get_channel(new_channel_id)
-            if not channel_obj or not isinstance(channel_obj, discord.TextChannel):
+            channel_obj = await resolve_channel(new_channel_id)
+            # Само канали от същия сървър - ID от чужд guild се отказва
+            if not channel_in_guild(channel_obj, interaction.guild_id):
                 await interaction.response.send_message(f"❌ Канал с ID {new_channel_id} не съществува.", ephemeral=True)
                 return
         elif channel_value:
@@ -226,165 +991,760 @@ class EditModal(discord.ui.Modal):
                 await interaction.response.send_message(f"❌ Канал с име '{channel_value}' не е намерен.", ephemeral=True)
                 return
             new_channel_id = channel_obj.id
+        # Графикът може да е изтрит, докато модалът е бил отворен
+        msg = get_message_data(self.key)
+        if not msg:
+            await interaction.response.send_message("❌ Съобщението не е намерено.", ephemeral=True)
+            return
+        try:
+            interval, cron, tz_name = parse_schedule_spec(self.interval_input.value, DEFAULT_TIMEZONE)
+            delivery, username, avatar_url = parse_delivery_spec(self.delivery_input.value)
+            # Същите правила като /create (текст, repeat >= 0); ID-то не се сменя
+            _, content, interval, repeat, _ = validate_schedule(
+                msg.id, self.content_input.value, interval, self.repeat_input.value.strip(),
+                new_channel_id or schedule_channel(msg), lambda msg_id: False
+            )
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+            return
 
+        update_message_content_value(self.key, content)
+        update_delivery_value(self.key, delivery, username, avatar_url)
+        update_cron_value(self.key, cron, tz_name)
+        update_interval_value(self.key, interval)
+        update_repeat_value(self.key, repeat)
         if new_channel_id:
-            update_channel_value(self.msg_id, new_channel_id)
+            update_channel_value(self.key, new_channel_id)
 
-        msg = get_message_data(self.msg_id)
-        if msg and msg.get("status") == "active":
-            await restart_message_task(self.msg_id, start_immediately=False)
+        if msg.status == STATUS_ACTIVE:
+            await restart_message_task(self.key, start_immediately=False)
 
         await interaction.response.send_message("✅ Съобщението беше обновено.", ephemeral=True)
 
-# === FullMessageButtons с callback функции ===
-class FullMessageButtons(discord.ui.View):
-    def __init__(self, msg_id: str, guild: discord.Guild):
-        super().__init__(timeout=None)
+# === Постоянни бутони, маршрутизирани по custom_id ===
+# custom_id носи действието и ID-то ("amb:<action>:<msg_id>"), така че един
+# регистриран при старт клас обслужва бутоните на всички съобщения, вкл.
+# тези отпреди рестарт. Изгледите се изпращат вече спрени (stop()), за да не
+# остават в view store-а на discord.py след всяко /list.
+SCHEDULE_ACTIONS = {
+    "start": ("▶️ Start", discord.ButtonStyle.green),
+    "stop": ("⏹️ Stop", discord.ButtonStyle.blurple),
+    "delete": ("🗑️ Delete", discord.ButtonStyle.red),
+    "edit": ("✏️ Edit", discord.ButtonStyle.gray)
+}
+
+# ID-то в custom_id е в рамките на guild-а, от който идва interaction-ът
+async def start_action(interaction: discord.Interaction, msg_id: str):
+    key = schedule_key(interaction.guild_id, msg_id)
+    msg = active_messages.get(key)
+    if not msg:
+        await interaction.response.send_message("❌ Съобщението не е намерено.", ephemeral=True)
+        return
+    if msg.status == STATUS_ACTIVE:
+        await interaction.response.send_message("⚠️ Вече е активно.", ephemeral=True)
+        return
+    msg.status = STATUS_ACTIVE
+    msg.failures = 0
+    msg.last_error = None
+    await restart_message_task(key)
+    if msg.status == STATUS_FAILED:
+        await interaction.response.send_message(f"❌ '{msg_id}' не може да стартира: {msg.last_error}", ephemeral=True)
+        return
+    await interaction.response.send_message(f"✅ '{msg_id}' стартирано.", ephemeral=True)
+
+async def stop_action(interaction: discord.Interaction, msg_id: str):
+    key = schedule_key(interaction.guild_id, msg_id)
+    msg = active_messages.get(key)
+    if not msg:
+        await interaction.response.send_message("❌ Съобщението не съществува.", ephemeral=True)
+        return
+    msg.status = STATUS_STOPPED
+    scheduler.remove(key)
+    save_message(key)
+    await interaction.response.send_message(f"⏸️ '{msg_id}' е спряно.", ephemeral=True)
+
+async def delete_action(interaction: discord.Interaction, msg_id: str):
+    key = schedule_key(interaction.guild_id, msg_id)
+    if key not in active_messages:
+        await interaction.response.send_message("❌ Съобщението не съществува.", ephemeral=True)
+        return
+    active_messages.pop(key, None)
+    scheduler.remove(key)
+    save_message(key)
+    await interaction.response.send_message(f"🗑️ '{msg_id}' изтрито.", ephemeral=True)
+
+async def edit_action(interaction: discord.Interaction, msg_id: str):
+    key = schedule_key(interaction.guild_id, msg_id)
+    if key not in active_messages:
+        await interaction.response.send_message("❌ Съобщението не е намерено.", ephemeral=True)
+        return
+    await interaction.response.send_modal(EditModal(key, interaction.guild))
+
+SCHEDULE_ROUTES = {
+    "start": start_action,
+    "stop": stop_action,
+    "delete": delete_action,
+    "edit": edit_action
+}
+
+class ScheduleButton(discord.ui.DynamicItem[discord.ui.Button], template=r"amb:(?P<action>start|stop|delete|edit):(?P<msg_id>.+)"):
+    def __init__(self, action: str, msg_id: str):
+        label, style = SCHEDULE_ACTIONS[action]
+        super().__init__(discord.ui.Button(label=label, style=style, custom_id=f"amb:{action}:{msg_id}"))
+        self.action = action
         self.msg_id = msg_id
-        self.guild = guild
 
-    @discord.ui.button(label="▶️ Start", style=discord.ButtonStyle.green)
-    async def start_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not has_permission(interaction.user):
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["action"], match["msg_id"])
+
+    @timed_handler(lambda self, interaction: f"button:{self.action}")
+    async def callback(self, interaction: discord.Interaction):
+        if not await has_permission(interaction):
             await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
             return
-        msg = active_messages.get(self.msg_id)
-        if not msg:
-            await interaction.response.send_message("❌ Съобщението не е намерено.", ephemeral=True)
-            return
-        if msg["status"] == "active":
-            await interaction.response.send_message("⚠️ Вече е активно.", ephemeral=True)
+        await SCHEDULE_ROUTES[self.action](interaction, self.msg_id)
+
+def schedule_controls(msg_id: str) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    for action in SCHEDULE_ACTIONS:
+        view.add_item(ScheduleButton(action, msg_id))
+    view.stop()
+    return view
+
+# === Странициран списък (/list) ===
+# Състоянието (страница и филтри) също е в custom_id:
+# "amb:list:<действие>:<страница>:<status>:<channel>:<creator>:<prefix>"
+LIST_STATE_PATTERN = r"(?P<page>\d+):(?P<status>[asf-]):(?P<channel>\d*):(?P<creator>[^:]*):(?P<prefix>.*)"
+
+def encode_list_state(page: int, status: Optional[str], channel_id: Optional[int], creator: Optional[str], prefix: Optional[str]) -> str:
+    return f"{page}:{(status or '-')[0]}:{channel_id or ''}:{creator or ''}:{prefix or ''}"
+
+def decode_list_state(match) -> tuple:
+    status = {"a": STATUS_ACTIVE, "s": STATUS_STOPPED, "f": STATUS_FAILED}.get(match["status"])
+    channel_id = int(match["channel"]) if match["channel"] else None
+    return int(match["page"]), status, channel_id, match["creator"] or None, match["prefix"] or None
+
+class ListNavButton(discord.ui.DynamicItem[discord.ui.Button], template=r"amb:list:(?P<action>prev|next|jump):" + LIST_STATE_PATTERN):
+    def __init__(self, action: str, query: tuple, label: str, disabled: bool = False):
+        super().__init__(discord.ui.Button(
+            label=label,
+            style=discord.ButtonStyle.gray,
+            custom_id=f"amb:list:{action}:{encode_list_state(*query)}",
+            disabled=disabled,
+            row=1
+        ))
+        self.action = action
+        self.query = query
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["action"], decode_list_state(match), item.label)
+
+    @timed_handler(lambda self, interaction: f"list:{self.action}")
+    async def callback(self, interaction: discord.Interaction):
+        if not await has_permission(interaction):
+            await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
             return
-        msg["status"] = "active"
-        await restart_message_task(self.msg_id)
-        await interaction.response.send_message(f"✅ '{self.msg_id}' стартирано.", ephemeral=True)
+        page, status, channel_id, creator, prefix = self.query
+        if self.action == "jump":
+            await interaction.response.send_modal(PageJumpModal(status, channel_id, creator, prefix, page))
+        else:
+            page = page - 1 if self.action == "prev" else page + 1
+            await interaction.response.edit_message(**render_list_page(interaction.guild_id, page, status, channel_id, creator, prefix))
+
+class ListManageSelect(discord.ui.DynamicItem[discord.ui.Select], template=r"amb:pick"):
+    def __init__(self, item: discord.ui.Select):
+        super().__init__(item)
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Select, match):
+        return cls(item)
 
-    @discord.ui.button(label="⏹️ Stop", style=discord.ButtonStyle.blurple)
-    async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not has_permission(interaction.user):
+    @timed_handler("list:pick")
+    async def callback(self, interaction: discord.Interaction):
+        if not await has_permission(interaction):
             await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
             return
-        msg = active_messages.get(self.msg_id)
+        msg = active_messages.get(schedule_key(interaction.guild_id, self.item.values[0]))
         if not msg:
-            await interaction.response.send_message("❌ Съобщението не съществува.", ephemeral=True)
-            return
-        msg["status"] = "stopped"
-        task = msg.get("task")
-        if task:
-            try:
-                task.cancel()
-            except Exception:
-                pass
-        save_messages()
-        await interaction.response.send_message(f"⏸️ '{self.msg_id}' е спряно.", ephemeral=True)
-
-    @discord.ui.button(label="🗑️ Delete", style=discord.ButtonStyle.red)
-    async def delete_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not has_permission(interaction.user):
-            await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+            await interaction.response.send_message("❌ Съобщението не е намерено.", ephemeral=True)
             return
-        msg = active_messages.pop(self.msg_id, None)
-        if msg and msg.get("task"):
-            try:
-                msg["task"].cancel()
-            except Exception:
-                pass
-        save_messages()
-        await interaction.response.send_message(f"🗑️ '{self.msg_id}' изтрито.", ephemeral=True)
-
-    @discord.ui.button(label="✏️ Edit", style=discord.ButtonStyle.gray)
-    async def edit_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not has_permission(interaction.user):
-            await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        await interaction.response.send_message(embed=get_info_embed(msg), view=schedule_controls(msg.id), ephemeral=True)
+
+class PageJumpModal(discord.ui.Modal):
+    def __init__(self, status: Optional[str], channel_id: Optional[int], creator: Optional[str], prefix: Optional[str], page: int):
+        super().__init__(title="Отиди на страница", timeout=300)
+        self.query = (status, channel_id, creator, prefix)
+        self.page_input = discord.ui.TextInput(label="Страница", default=str(page + 1))
+        self.add_item(self.page_input)
+
+    @timed_handler("modal:jump")
+    async def on_submit(self, interaction: discord.Interaction):
+        value = self.page_input.value.strip()
+        if not value.isdigit():
+            await interaction.response.send_message("❌ Невалиден номер на страница.", ephemeral=True)
             return
-        await interaction.response.send_modal(EditModal(self.msg_id, self.guild))
+        await interaction.response.edit_message(**render_list_page(interaction.guild_id, int(value) - 1, *self.query))
+
+def render_list_page(
+    guild_id: int,
+    page: int,
+    status: Optional[str],
+    channel_id: Optional[int],
+    creator: Optional[str],
+    prefix: Optional[str]
+) -> dict:
+    msg_ids = filter_messages(guild_id, status, channel_id, creator, prefix)
+    page_count = max(1, math.ceil(len(msg_ids) / LIST_PAGE_SIZE))
+    page = min(max(page, 0), page_count - 1)
+    ids = msg_ids[page * LIST_PAGE_SIZE:(page + 1) * LIST_PAGE_SIZE]
+    query = (page, status, channel_id, creator, prefix)
+
+    view = discord.ui.View(timeout=None)
+    if ids:
+        view.add_item(ListManageSelect(discord.ui.Select(
+            custom_id="amb:pick",
+            placeholder="Управление на съобщение…",
+            options=[discord.SelectOption(label=i[:100], value=i) for i in ids],
+            row=0
+        )))
+    view.add_item(ListNavButton("prev", query, "◀️", disabled=page == 0))
+    view.add_item(ListNavButton("jump", query, "🔢 Страница"))
+    view.add_item(ListNavButton("next", query, "▶️", disabled=page >= page_count - 1))
+    view.stop()
+
+    content = f"📋 Автоматични съобщения: {len(msg_ids)} (страница {page + 1}/{page_count})"
+    embeds = [get_info_embed(active_messages[schedule_key(guild_id, i)]) for i in ids]
+    return {"content": content, "embeds": embeds, "view": view}
 
 # === Дефиниция на slash командите ===
 @tree.command(name="create", description="Създай ново автоматично съобщение.")
 @app_commands.describe(
     message="Текст на съобщението",
-    interval="Интервал в минути",
     repeat="Брой повторения (0 = безкрайно)",
     id="Уникален идентификатор",
-    channel="Избери канал за изпращане на съобщението"
+    interval="Интервал в минути (ако няма cron)",
+    channel="Избери канал за изпращане на съобщението",
+    cron="Cron израз вместо интервал, напр. '0 9 * * 1-5' или '0 9 * * 1#1'",
+    timezone="Часова зона за cron, напр. Europe/Sofia",
+    delivery="Изпращане от бота (по подразбиране) или през webhook на канала",
+    username="Име на подателя при webhook",
+    avatar_url="Аватар (URL) на подателя при webhook"
 )
+@timed_handler("command:create")
 async def create(
     interaction: discord.Interaction,
     message: str,
-    interval: int,
     repeat: int,
-    id: str,
-    channel: Optional[discord.TextChannel] = None  # Тук е новият параметър
+    id: app_commands.Range[str, 1, 80],
+    interval: Optional[int] = None,
+    channel: Optional[discord.TextChannel] = None,  # Тук е новият параметър
+    cron: Optional[app_commands.Range[str, 1, 100]] = None,
+    timezone: Optional[str] = None,
+    delivery: Optional[Literal["bot", "webhook"]] = None,
+    username: Optional[app_commands.Range[str, 1, 80]] = None,
+    avatar_url: Optional[app_commands.Range[str, 1, 512]] = None
 ):
-    if not has_permission(interaction.user):
+    if not await has_permission(interaction):
         await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
         return
-    if id in active_messages:
-        await interaction.response.send_message(f"⚠️ Съобщение с ID '{id}' вече съществува.", ephemeral=True)
-        return
-
-    channel_id_for_task = channel.id if channel else (CHANNEL_ID if CHANNEL_ID else None)
+    guild_id = interaction.guild_id
+    state = guild_states[guild_id]
+    channel_id_for_task = channel.id if channel else default_channel_id(guild_id)
     if not channel_id_for_task:
         await interaction.response.send_message(
-            "❌ Не е зададен канал. Можете да подадете канал като параметър или да зададете CHANNEL_ID в env.",
+            "❌ Не е зададен канал. Можете да подадете канал като параметър или да зададете канал по подразбиране с /config.",
             ephemeral=True
         )
         return
+    quota = guild_quota(state)
+    if quota and len(state) >= quota:
+        await interaction.response.send_message(f"⚠️ Достигната е квотата от {quota} съобщения за този сървър.", ephemeral=True)
+        return
+    if cron is None and interval is None:
+        await interaction.response.send_message("❌ Задайте interval (минути) или cron израз.", ephemeral=True)
+        return
+    timezone = (timezone or DEFAULT_TIMEZONE) if cron else None
+    try:
+        if cron:
+            compile_cron(cron, timezone)
+        id, message, interval, repeat, channel_id_for_task = validate_schedule(
+            id, message, 0 if cron else interval, repeat, channel_id_for_task,
+            lambda msg_id: schedule_key(guild_id, msg_id) in active_messages
+        )
+        delivery, username, avatar_url = validate_delivery(delivery, username, avatar_url)
+    except ValueError as e:
+        await interaction.response.send_message(f"⚠️ {e}.", ephemeral=True)
+        return
 
-    msg_data = {
-        "task": None,
-        "message": message,
-        "interval": interval,
-        "repeat": repeat,
-        "id": id,
-        "creator": interaction.user.name,
-        "status": "active",
-        "channel_id": channel_id_for_task
-    }
+    msg_data = Schedule(
+        id=id,
+        message=message,
+        interval=interval,
+        repeat=repeat,
+        creator=interaction.user.name,
+        status=STATUS_ACTIVE,
+        channel_id=channel_id_for_task,
+        cron=cron,
+        timezone=timezone,
+        guild_id=guild_id,
+        delivery=delivery,
+        username=username,
+        avatar_url=avatar_url
+    )
 
-    active_messages[id] = msg_data
-    save_messages()
-    await restart_message_task(id, start_immediately=True)
+    key = msg_data.key
+    active_messages[key] = msg_data
+    save_message(key)
+    await restart_message_task(key, start_immediately=True)
     await interaction.response.send_message(
-        f"✅ Създадено съобщение '{id}' в канал {channel.mention if channel else f'<#{CHANNEL_ID}>'}.",
+        f"✅ Създадено съобщение '{id}' в канал <#{channel_id_for_task}>.",
         ephemeral=True
     )
 
+TIMEZONES = sorted(available_timezones())
+
+@create.autocomplete("timezone")
+async def timezone_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    current = current.lower()
+    matches = [tz for tz in TIMEZONES if current in tz.lower()][:25]
+    return [app_commands.Choice(name=tz, value=tz) for tz in matches]
+
 @tree.command(name="list", description="Покажи всички автоматични съобщения.")
-async def list_messages(interaction: discord.Interaction):
-    if not has_permission(interaction.user):
+@app_commands.describe(
+    status="(по избор) само активни, спрени или неуспешни (dead-letter)",
+    channel="(по избор) само за този канал",
+    creator="(по избор) само от този създател",
+    prefix="(по избор) ID започва с"
+)
+@timed_handler("command:list")
+async def list_messages(
+    interaction: discord.Interaction,
+    status: Optional[Literal["active", "stopped", "failed"]] = None,
+    channel: Optional[discord.TextChannel] = None,
+    creator: Optional[app_commands.Range[str, 1, 32]] = None,
+    prefix: Optional[app_commands.Range[str, 1, 24]] = None
+):
+    if not await has_permission(interaction):
         await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
         return
-    if not active_messages:
+
+    channel_id = channel.id if channel else None
+    if not filter_messages(interaction.guild_id, status, channel_id, creator, prefix):
         await interaction.response.send_message("ℹ️ Няма съобщения.", ephemeral=True)
         return
 
-    await interaction.response.send_message("📋 Всички автоматични съобщения:", ephemeral=True)
-    for msg in active_messages.values():
-        embed = build_info_embed(msg)
-        try:
-            await interaction.followup.send(
-                embed=embed,
-                view=FullMessageButtons(msg['id'], interaction.guild),
-                ephemeral=True
-            )
-        except Exception as e:
-            print(f"❌ Не успя да се изпрати followup за {msg.get('id')}: {e}")
+    await interaction.response.send_message(
+        **render_list_page(interaction.guild_id, 0, status, channel_id, creator, prefix),
+        ephemeral=True
+    )
+
+# === Масов импорт/експорт ===
+# Файлът се сваля на части във временен файл (на диска над SPOOL_MAX_BYTES)
+# и се чете ред по ред. Всяка партида от IMPORT_BATCH_SIZE валидни реда е
+# един flush към store и едно масово вмъкване в планировчика.
+async def download_attachment(attachment: discord.Attachment, fp) -> None:
+    async with http_session().get(attachment.url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            fp.write(chunk)
+
+async def apply_import_batch(batch: List[Schedule]) -> None:
+    for msg in batch:
+        active_messages[msg.key] = msg
+    save_many(batch)
+    # Бъдещата фаза се пази и отива в планировчика с едно масово вмъкване;
+    # липсваща или минала фаза - както при рестарт (resume_message, т.е.
+    # CATCHUP_POLICY, cron - следващото съвпадение) и разсрочено в
+    # STARTUP_SPREAD_SECONDS, а не всички в един и същи момент
+    now = scheduler.now()
+    due = []
+    overdue = []
+    for msg in batch:
+        if not msg.active:
+            continue
+        key = msg.key
+        if msg.next_fire_at is not None and msg.next_fire_at > now:
+            if owns_schedule(msg):
+                due.append((key, msg.next_fire_at))
+        elif resume_message(key, now):
+            overdue.append(key)
+    await store.flush()
+    scheduler.schedule_many(due)
+    spread_overdue(overdue, now)
+
+async def import_schedules(fp, fmt: str, creator: str, state: GuildState) -> tuple:
+    imported = 0
+    errors = []
+    batch = []
+    seen = set()
+    channels = {}
+    guild_id = state.guild_id
+    quota = guild_quota(state)
+
+    def exists(msg_id: str) -> bool:
+        return schedule_key(guild_id, msg_id) in active_messages or msg_id in seen
+
+    for line_no, row, error in iter_rows(fp, fmt):
+        if error is None and quota and len(state) + len(batch) >= quota:
+            error = f"достигната е квотата от {quota} съобщения"
+        if error is None:
+            try:
+                msg = build_schedule(row, exists, default_channel_id(guild_id), creator, guild_id)
+                if msg.channel_id not in channels:
+                    channel = await resolve_channel(msg.channel_id)
+                    channels[msg.channel_id] = channel_in_guild(channel, guild_id)
+                if not channels[msg.channel_id]:
+                    error = f"Канал с ID {msg.channel_id} не съществува в този сървър"
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            errors.append(f"ред {line_no}: {error}")
+            continue
+        seen.add(msg.id)
+        batch.append(msg)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await apply_import_batch(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        await apply_import_batch(batch)
+        imported += len(batch)
+    return imported, errors
+
+@tree.command(name="import", description="Масово създаване на съобщения от JSONL или CSV файл.")
+@app_commands.describe(
+    file="JSONL (по един обект на ред) или CSV със заглавен ред",
+    format="(по избор) формат, ако не личи от името на файла"
+)
+@timed_handler("command:import")
+async def import_messages(
+    interaction: discord.Interaction,
+    file: discord.Attachment,
+    format: Optional[Literal["jsonl", "csv"]] = None
+):
+    if not await has_permission(interaction):
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+    fmt = format or detect_format(file.filename)
+    if not fmt:
+        await interaction.response.send_message("❌ Неизвестен формат - използвайте .jsonl или .csv.", ephemeral=True)
+        return
+    if file.size > IMPORT_MAX_BYTES:
+        await interaction.response.send_message(f"❌ Файлът е над {IMPORT_MAX_BYTES // (1024 * 1024)} MiB.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as raw:
+        await download_attachment(file, raw)
+        raw.seek(0)
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+        imported, errors = await import_schedules(text, fmt, interaction.user.name, guild_states[interaction.guild_id])
+        text.detach()
+
+    log.info(f"📥 Импорт от {file.filename}", extra={"imported": imported, "errors": len(errors)})
+    content = f"📥 Импортирани: {imported}, грешки: {len(errors)}."
+    if not errors:
+        await interaction.followup.send(content, ephemeral=True)
+        return
+    preview = "\n".join(errors[:10])
+    if len(errors) > 10:
+        # Пълният списък с грешки е в прикачен файл
+        report = discord.File(io.BytesIO("\n".join(errors).encode("utf-8")), filename="import_errors.txt")
+        await interaction.followup.send(f"{content}\n```\n{preview}\n…\n```", file=report, ephemeral=True)
+    else:
+        await interaction.followup.send(f"{content}\n```\n{preview}\n```", ephemeral=True)
+
+@tree.command(name="export", description="Изтегли всички автоматични съобщения като JSONL или CSV.")
+@app_commands.describe(
+    format="Формат на файла",
+    status="(по избор) само активни, спрени или неуспешни (dead-letter)"
+)
+@timed_handler("command:export")
+async def export_messages(
+    interaction: discord.Interaction,
+    format: Literal["jsonl", "csv"] = "jsonl",
+    status: Optional[Literal["active", "stopped", "failed"]] = None
+):
+    if not await has_permission(interaction):
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    guild_id = interaction.guild_id
+    keys = [schedule_key(guild_id, i) for i in filter_messages(guild_id, status)]
+    limit = interaction.guild.filesize_limit if interaction.guild else 10 * 1024 * 1024
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as out:
+        for n, chunk in enumerate(iter_export((active_messages[k] for k in keys if k in active_messages), format)):
+            out.write(chunk.encode("utf-8"))
+            if n % 5000 == 4999:
+                await asyncio.sleep(0)
+        size = out.tell()
+        if size > limit:
+            await interaction.followup.send(f"❌ Експортът е {size // 1024} KiB - над лимита за файлове на сървъра.", ephemeral=True)
+            return
+        out.seek(0)
+        await interaction.followup.send(
+            f"📤 Експортирани: {len(keys)} съобщения.",
+            file=discord.File(out, filename=f"schedules.{format}"),
+            ephemeral=True
+        )
+
+# === Търсене и управление по ID ===
+# Автодопълването се обслужва изцяло от индекса на guild-а (bisect по
+# сортираните ID-та и dict-ове по канал/създател), без обхождане.
+MAX_FIND_PREFIX = 24
+
+async def id_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    if not await has_permission(interaction):
+        return []
+    status = STATUS_ACTIVE if interaction.command and interaction.command.name == "stop" else None
+    index = guild_states[interaction.guild_id].index
+    return [app_commands.Choice(name=i[:100], value=i) for i in index.complete(current, status=status)]
+
+async def channel_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    if not await has_permission(interaction):
+        return []
+    current = current.lower().lstrip("#")
+    choices = []
+    for channel_id, ids in guild_states[interaction.guild_id].index.by_channel.items():
+        if not channel_id:
+            continue
+        channel = bot.get_channel(channel_id)
+        name = channel.name if channel else str(channel_id)
+        if current in name.lower() or current in str(channel_id):
+            choices.append(app_commands.Choice(name=f"#{name} ({len(ids)})"[:100], value=str(channel_id)))
+            if len(choices) >= 25:
+                break
+    return choices
+
+async def creator_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    if not await has_permission(interaction):
+        return []
+    current = current.lower()
+    by_creator = guild_states[interaction.guild_id].index.by_creator
+    names = [name for name in by_creator if name and name.lower().startswith(current)]
+    return [app_commands.Choice(name=f"{name} ({len(by_creator[name])})", value=name) for name in sorted(names)[:25]]
+
+@tree.command(name="find", description="Търсене на съобщения по ID, канал, създател и статус.")
+@app_commands.describe(
+    query="ID или начало на ID",
+    channel="(по избор) канал с графици",
+    creator="(по избор) създател",
+    status="(по избор) само активни, спрени или неуспешни (dead-letter)"
+)
+@app_commands.autocomplete(query=id_autocomplete, channel=channel_autocomplete, creator=creator_autocomplete)
+@timed_handler("command:find")
+async def find_messages(
+    interaction: discord.Interaction,
+    query: Optional[app_commands.Range[str, 1, 80]] = None,
+    channel: Optional[str] = None,
+    creator: Optional[app_commands.Range[str, 1, 32]] = None,
+    status: Optional[Literal["active", "stopped", "failed"]] = None
+):
+    if not await has_permission(interaction):
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+
+    # Точно ID -> директно карта с бутоните за управление
+    guild_id = interaction.guild_id
+    msg = active_messages.get(schedule_key(guild_id, query)) if query else None
+    if msg and not (channel or creator or status):
+        await interaction.response.send_message(embed=get_info_embed(msg), view=schedule_controls(msg.id), ephemeral=True)
+        return
+    if channel and not channel.isdigit():
+        await interaction.response.send_message("❌ Изберете канал от списъка.", ephemeral=True)
+        return
+    channel_id = int(channel) if channel else None
+    # Префиксът влиза в custom_id на бутоните за страниране - по-дълъг е само точно ID
+    if query and len(query) > MAX_FIND_PREFIX:
+        await interaction.response.send_message(f"ℹ️ Няма съобщение с ID '{query}'.", ephemeral=True)
+        return
+
+    if not filter_messages(guild_id, status, channel_id, creator, query):
+        await interaction.response.send_message("ℹ️ Няма съобщения.", ephemeral=True)
+        return
+    await interaction.response.send_message(**render_list_page(guild_id, 0, status, channel_id, creator, query), ephemeral=True)
+
+@tree.command(name="stop", description="Спри автоматично съобщение по ID.")
+@app_commands.describe(id="ID на съобщението")
+@app_commands.autocomplete(id=id_autocomplete)
+@timed_handler("command:stop")
+async def stop_message(interaction: discord.Interaction, id: app_commands.Range[str, 1, 80]):
+    if not await has_permission(interaction):
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+    await stop_action(interaction, id)
+
+@tree.command(name="delete", description="Изтрий автоматично съобщение по ID.")
+@app_commands.describe(id="ID на съобщението")
+@app_commands.autocomplete(id=id_autocomplete)
+@timed_handler("command:delete")
+async def delete_message(interaction: discord.Interaction, id: app_commands.Range[str, 1, 80]):
+    if not await has_permission(interaction):
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+    await delete_action(interaction, id)
+
+# === Повторно пускане на dead-letter графиците ===
+# След като каналът е оправен (права, нов канал през ✏️ Edit) - всички
+# неуспешни наведнъж. Всеки канал се проверява веднъж; първите изпращания се
+# разпределят в STARTUP_SPREAD_SECONDS като при старт (cron - след следващото
+# съвпадение), а sent_count се запазва.
+@tree.command(name="requeue", description="Пусни отново неуспешните (dead-letter) съобщения.")
+@app_commands.describe(
+    channel="(по избор) само за този канал",
+    prefix="(по избор) ID започва с"
+)
+@timed_handler("command:requeue")
+async def requeue_messages(
+    interaction: discord.Interaction,
+    channel: Optional[discord.TextChannel] = None,
+    prefix: Optional[app_commands.Range[str, 1, 80]] = None
+):
+    if not await has_permission(interaction):
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+    guild_id = interaction.guild_id
+    msg_ids = guild_states[guild_id].index.query(STATUS_FAILED, channel.id if channel else None, None, prefix)
+    if not msg_ids:
+        await interaction.response.send_message("ℹ️ Няма неуспешни съобщения.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
+    available = {}
+    requeued = []
+    now = scheduler.now()
+    for msg_id in msg_ids:
+        msg = active_messages[schedule_key(guild_id, msg_id)]
+        channel_id = schedule_channel(msg)
+        if channel_id not in available:
+            available[channel_id] = channel_in_guild(await resolve_channel(channel_id), guild_id)
+        if not available[channel_id]:
+            continue
+        # Cron графикът чака следващото съвпадение, както при ▶️ Start
+        next_at = compile_cron(msg.cron, msg.timezone).next_after(now) if msg.cron else now
+        if next_at is not None:
+            requeued.append((msg, next_at))
+
+    for i, (msg, next_at) in enumerate(requeued):
+        msg.status = STATUS_ACTIVE
+        msg.failures = 0
+        msg.last_error = None
+        msg.next_fire_at = next_at + STARTUP_SPREAD_SECONDS * i / len(requeued)
+    save_many([msg for msg, _ in requeued])
+    for msg, _ in requeued:
+        schedule_local(msg.key, msg.next_fire_at)
+
+    content = f"🔁 Пуснати отново: {len(requeued)}."
+    if len(requeued) < len(msg_ids):
+        content += f"\n⚠️ {len(msg_ids) - len(requeued)} остават в dead-letter - каналът им все още не е достъпен (или cron изразът няма следващо съвпадение)."
+    await interaction.followup.send(content, ephemeral=True)
+
+# === Настройки на сървъра ===
+# Само с право "Manage Server" - ролите с достъп до командите не могат да
+# си разширяват правата сами.
+def build_config_embed(state: GuildState, guild_obj: Optional[discord.Guild]) -> discord.Embed:
+    config = state.config
+    if config.role_ids:
+        roles = ", ".join(f"<@&{role_id}>" for role_id in sorted(config.role_ids))
+    else:
+        roles = ", ".join(ALLOWED_ROLES) + " (по име)"
+    quota = guild_quota(state)
+    embed = discord.Embed(title=f"⚙️ Настройки на {guild_obj.name if guild_obj else state.guild_id}", color=discord.Color.blue())
+    embed.add_field(name="Канал по подразбиране", value=f"<#{config.channel_id}>" if config.channel_id else "—", inline=False)
+    embed.add_field(name="Роли с достъп", value=roles or "—", inline=False)
+    embed.add_field(name="Съобщения / квота", value=f"{len(state)} / {quota or '∞'}", inline=False)
+    return embed
+
+@tree.command(name="config", description="Настройки на сървъра: канал по подразбиране, роли с достъп и квота.")
+@app_commands.describe(
+    channel="(по избор) канал по подразбиране за нови съобщения",
+    add_role="(по избор) роля, която получава достъп до командите",
+    remove_role="(по избор) роля, която губи достъп",
+    quota="(по избор) максимален брой съобщения в сървъра (0 = без лимит)"
+)
+@app_commands.default_permissions(manage_guild=True)
+@timed_handler("command:config")
+async def config_guild(
+    interaction: discord.Interaction,
+    channel: Optional[discord.TextChannel] = None,
+    add_role: Optional[discord.Role] = None,
+    remove_role: Optional[discord.Role] = None,
+    quota: Optional[app_commands.Range[int, 0, 1000000]] = None
+):
+    if interaction.guild_id is None or not interaction.permissions.manage_guild:
+        await interaction.response.send_message("🚫 Нямаш права.", ephemeral=True)
+        return
+    state = await ensure_guild(interaction.guild_id)
+    if channel or add_role or remove_role or quota is not None:
+        config = state.config
+        role_ids = set(config.role_ids)
+        if add_role:
+            role_ids.add(add_role.id)
+        if remove_role:
+            role_ids.discard(remove_role.id)
+        state.config = GuildConfig(
+            channel_id=channel.id if channel else config.channel_id,
+            role_ids=role_ids,
+            quota=quota if quota is not None else config.quota
+        )
+        await store.set_guild_config(state.guild_id, state.config.to_storage())
+        allowed_role_cache.pop(state.guild_id, None)
+        log.info("⚙️ Променени настройки на guild", extra={"guild_id": state.guild_id, "config": repr(state.config)})
+    await interaction.response.send_message(embed=build_config_embed(state, interaction.guild), ephemeral=True)
 
 # Регистрация на помощна команда като /help_create
 @tree.command(name="help_create", description="Помощ за командите (замества /help)")
 @app_commands.describe(command="(по избор) име на команда за подробна справка")
+@timed_handler("command:help_create")
 async def help_create(interaction: discord.Interaction, command: Optional[str] = None):
     commands_info = {
         "create": {
             "description": "Създава ново автоматично съобщение.",
-            "usage": "/create message:<текст> interval:<минути> repeat:<брой (0=∞)> id:<уникално> [channel:<канал>]",
-            "example": "/create message:Здравей! interval:60 repeat:0 id:morning channel:#announcements"
+            "usage": "/create message:<текст> repeat:<брой (0=∞)> id:<уникално> (interval:<минути> | cron:<израз> [timezone:<зона>]) [channel:<канал>] [delivery:<bot|webhook> [username:<име>] [avatar_url:<URL>]]",
+            "example": "/create message:Добро утро! repeat:0 id:morning cron:0 9 * * 1-5 timezone:Europe/Sofia channel:#announcements"
         },
         "list": {
-            "description": "Показва всички автоматични съобщения и бутони за управление.",
-            "usage": "/list",
-            "example": "/list"
+            "description": "Показва автоматичните съобщения по страници (по 10) с бутони за управление.",
+            "usage": "/list [status:<active|stopped|failed>] [channel:<канал>] [creator:<име>] [prefix:<начало на ID>]",
+            "example": "/list status:active channel:#announcements"
+        },
+        "import": {
+            "description": "Масово създава съобщения от JSONL или CSV файл (колони: id, message, interval, repeat, channel_id, ...).",
+            "usage": "/import file:<файл> [format:<jsonl|csv>]",
+            "example": "/import file:schedules.csv"
+        },
+        "export": {
+            "description": "Изтегля съобщенията във файл, който може да се импортира обратно.",
+            "usage": "/export [format:<jsonl|csv>] [status:<active|stopped|failed>]",
+            "example": "/export format:csv status:active"
+        },
+        "find": {
+            "description": "Търси по ID (с автодопълване), канал, създател и статус; точно ID показва директно бутоните.",
+            "usage": "/find [query:<ID или начало>] [channel:<канал>] [creator:<име>] [status:<active|stopped|failed>]",
+            "example": "/find query:morning channel:#announcements"
+        },
+        "stop": {
+            "description": "Спира съобщение по ID.",
+            "usage": "/stop id:<ID>",
+            "example": "/stop id:morning"
+        },
+        "delete": {
+            "description": "Изтрива съобщение по ID.",
+            "usage": "/delete id:<ID>",
+            "example": "/delete id:morning"
+        },
+        "requeue": {
+            "description": "Пуска отново неуспешните (dead-letter) съобщения, след като каналът е оправен.",
+            "usage": "/requeue [channel:<канал>] [prefix:<начало на ID>]",
+            "example": "/requeue channel:#announcements"
+        },
+        "config": {
+            "description": "Показва и променя настройките на сървъра: канал по подразбиране, роли с достъп и квота (Manage Server).",
+            "usage": "/config [channel:<канал>] [add_role:<роля>] [remove_role:<роля>] [quota:<брой, 0=∞>]",
+            "example": "/config channel:#announcements add_role:@Moderators quota:500"
         },
         "help_create": {
             "description": "Показва справка за командите (текуща работеща версия).",
@@ -433,55 +1793,121 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
             pass
         return
 
-    print(f"Unhandled app command error: {error}")
+    log.error(
+        f"Unhandled app command error: {error}",
+        exc_info=error,
+        extra={"command": interaction.command.qualified_name if interaction.command else None}
+    )
     try:
         await interaction.response.send_message("❌ Възникна грешка при изпълнение на командата.", ephemeral=True)
     except Exception:
         pass
 
-# === On_ready и пост-старт задачи ===
-@bot.event
-async def on_ready():
-    print(f"✅ Влязъл съм като {bot.user} (ботът е онлайн)", flush=True)
-
-    async def post_start_tasks():
-        await asyncio.sleep(2)
+# === Стартиране и пост-старт задачи ===
+# setup_hook се изпълнява веднъж на процес, докато on_ready - при всяко
+# повторно свързване с gateway. Затова тежката работа е тук, а не в on_ready.
+def command_tree_hash(target: Optional[discord.abc.Snowflake]) -> str:
+    payload = [cmd.to_dict(tree) for cmd in tree.get_commands(guild=target)]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
 
-        # --- Зареждане на активните съобщения ---
-        try:
-            await load_messages()
-            print("💬 Заредени са активните съобщения и задачите са рестартирани.", flush=True)
-        except Exception as e:
-            print(f"❌ Грешка при load_messages: {e}", flush=True)
+async def sync_commands():
+    # Командите са глобални - важат за всички guild-ове. Ако е зададен GUILD_ID,
+    # неговият (вече празен) guild-специфичен набор също се синхронизира, за
+    # да изчезнат старите локални копия на командите.
+    for target in (None, guild) if guild else (None,):
+        scope = f"guild {GUILD_ID}" if target else "global"
+        meta_key = f"command_hash:{GUILD_ID if target else 'global'}"
+        current_hash = command_tree_hash(target)
+        if await store.get_meta(meta_key) == current_hash:
+            log.info(f"🔁 Slash командите не са променени ({scope}), синхронизацията е пропусната")
+            continue
 
-        # --- Синхронизация на командите за guild ---
-        try:
-            if guild:
-                # Гарантираме, че всички команди с новите параметри се регистрират
-                await tree.sync(guild=guild)
-                print(f"🔁 Slash командите са синхронизирани локално за guild {GUILD_ID}", flush=True)
-                await asyncio.sleep(1)
-            else:
-                print("⚠️ Няма зададен guild, синхронизацията е пропусната", flush=True)
-        except Exception as e:
-            print(f"⚠️ Грешка при синхронизация: {e}", flush=True)
+        await tree.sync(guild=target)
+        await store.set_meta(meta_key, current_hash)
+        log.info(f"🔁 Slash командите са синхронизирани ({scope})")
 
         # --- Лог на регистрираните команди ---
-        try:
-            cmds = await tree.fetch_commands(guild=guild) if guild else []
-            print("📋 Списък с регистрирани команди:")
-            for c in cmds:
-                print(f"- {c.name} ({c.id})")
-        except Exception as e:
-            print(f"⚠️ Грешка при fetch на командите: {e}", flush=True)
+        cmds = await tree.fetch_commands(guild=target)
+        log.info("📋 Списък с регистрирани команди", extra={"scope": scope, "commands": {c.name: c.id for c in cmds}})
 
-        print("✅ post_start_tasks() приключи.", flush=True)
+async def post_start_tasks():
+    await bot.wait_until_ready()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    log.info(
+        f"⏱️ Готов за {time.monotonic() - PROCESS_STARTED:.2f} сек. след старта на процеса "
+        f"({'lean' if LEAN_MODE else 'full'} режим, RSS {rss_mb:.1f} MiB)"
+    )
+    scheduler.start()
 
+    # --- Зареждане на активните съобщения ---
+    try:
+        if cluster:
+            await cluster.join()
+        await load_messages()
+        log.info(
+            "💬 Заредени са активните съобщения и задачите са рестартирани.",
+            extra={"schedules": len(active_messages), "guilds": len(guild_states)}
+        )
+    except Exception as e:
+        log.exception(f"❌ Грешка при load_messages: {e}")
+    if cluster:
+        cluster.start()
+
+    # --- Синхронизация на командите ---
+    try:
+        await sync_commands()
+    except Exception as e:
+        log.warning(f"⚠️ Грешка при синхронизация: {e}")
+
+    log.info("✅ post_start_tasks() приключи.")
+
+@bot.event
+async def setup_hook():
+    # Постоянните бутони работят и върху съобщения отпреди рестарт
+    bot.add_dynamic_items(ScheduleButton, ListNavButton, ListManageSelect)
+    if METRICS_PORT:
+        try:
+            await start_metrics_server(metrics_registry, METRICS_HOST, METRICS_PORT, profiling=PROFILING)
+            log.info(f"📈 Метрики на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            log.warning(f"⚠️ Метриките не могат да стартират: {e}")
+        asyncio.create_task(monitor_event_loop(loop_block))
     asyncio.create_task(post_start_tasks())
 
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    allowed_role_cache.pop(after.guild.id, None)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    allowed_role_cache.pop(role.guild.id, None)
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    allowed_role_cache.pop(role.guild.id, None)
+
+_bot_close = bot.close
+
+async def close_bot():
+    await _bot_close()
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+bot.close = close_bot
+
+@bot.event
+async def on_ready():
+    log.info(f"✅ Влязъл съм като {bot.user} (ботът е онлайн)")
+
 # === Стартиране на бота ===
+# discord.py не добавя собствен handler - логовете му минават през опашката
 if not TOKEN:
-    print("❌ Не е зададен DISCORD_TOKEN.")
+    log.error("❌ Не е зададен DISCORD_TOKEN.")
 else:
-    bot.run(TOKEN)
+    try:
+        bot.run(TOKEN, log_handler=None)
+    finally:
+        if cluster:
+            asyncio.run(cluster.store.leave(CLUSTER_WORKER_ID))
+        store.close()
 
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+from typing import Callable, Iterable, Iterator, Optional, TextIO, Tuple
+
+from cron import compile_cron
+from models import STATUS_ACTIVE, STATUSES, Schedule
+from webhooks import validate_delivery
+
+FORMATS = ("jsonl", "csv")
+EXPORT_FIELDS = Schedule.__slots__
+MAX_ID_LENGTH = 80
+MAX_MESSAGE_LENGTH = 2000
+
+
+# === Общи правила за нов график ===
+# Ползват се от /create, /import и офлайн CLI-то. Грешките са ValueError
+# с текст, който може да се покаже директно на потребителя.
+def validate_schedule(
+    id,
+    message,
+    interval,
+    repeat,
+    channel_id,
+    exists: Callable[[str], bool]
+) -> Tuple[str, str, int, int, int]:
+    msg_id = str(id or "").strip()
+    if not msg_id or len(msg_id) > MAX_ID_LENGTH:
+        raise ValueError(f"ID трябва да е между 1 и {MAX_ID_LENGTH} символа")
+    if exists(msg_id):
+        raise ValueError(f"Съобщение с ID '{msg_id}' вече съществува")
+    message = str(message or "")
+    if not message.strip():
+        raise ValueError("Празен текст на съобщението")
+    if len(message) > MAX_MESSAGE_LENGTH:
+        raise ValueError(f"Текстът е над {MAX_MESSAGE_LENGTH} символа")
+    try:
+        interval = int(interval or 0)
+        repeat = int(repeat or 0)
+    except (TypeError, ValueError):
+        raise ValueError("interval и repeat трябва да са цели числа")
+    if interval < 0 or repeat < 0:
+        raise ValueError("interval и repeat не могат да са отрицателни")
+    if not channel_id:
+        raise ValueError("Не е зададен канал")
+    if not str(channel_id).isdigit():
+        raise ValueError(f"Невалиден канал '{channel_id}'")
+    return msg_id, message, interval, repeat, int(channel_id)
+
+
+def build_schedule(
+    row: dict,
+    exists: Callable[[str], bool],
+    default_channel_id: Optional[int],
+    creator: str,
+    guild_id: Optional[int] = None
+) -> Schedule:
+    # guild_id от файла се пренебрегва - редът отива в guild-а, който импортира
+    msg_id, message, interval, repeat, channel_id = validate_schedule(
+        row.get("id"),
+        row.get("message"),
+        row.get("interval"),
+        row.get("repeat"),
+        row.get("channel_id") or default_channel_id,
+        exists
+    )
+    cron = row.get("cron") or None
+    tz_name = row.get("timezone") or None
+    if cron:
+        compile_cron(cron, tz_name)
+    status = row.get("status") or STATUS_ACTIVE
+    if status not in STATUSES:
+        raise ValueError(f"Невалиден статус '{status}'")
+    try:
+        next_fire_at = float(row["next_fire_at"]) if row.get("next_fire_at") not in (None, "") else None
+        sent_count = int(row.get("sent_count") or 0)
+        failures = int(row.get("failures") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Невалидни next_fire_at/sent_count/failures")
+    delivery, username, avatar_url = validate_delivery(row.get("delivery"), row.get("username"), row.get("avatar_url"))
+    return Schedule(
+        id=msg_id,
+        message=message,
+        interval=interval,
+        repeat=repeat,
+        creator=row.get("creator") or creator,
+        status=status,
+        channel_id=channel_id,
+        next_fire_at=next_fire_at,
+        sent_count=sent_count,
+        cron=cron,
+        timezone=tz_name if cron else None,
+        guild_id=guild_id,
+        delivery=delivery,
+        username=username,
+        avatar_url=avatar_url,
+        failures=failures,
+        last_error=row.get("last_error") or None
+    )
+
+
+# === Четене ===
+# Ред по ред от отворен текстов файл: (номер на ред, данни, грешка).
+# CSV записите могат да са на няколко реда (текст с нови редове в кавички).
+def detect_format(filename: str) -> Optional[str]:
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return None
+
+
+def iter_rows(fp: TextIO, fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    if fmt == "csv":
+        reader = csv.DictReader(fp)
+        try:
+            for row in reader:
+                if None in row:
+                    yield reader.line_num, None, "повече колони от заглавния ред"
+                    continue
+                yield reader.line_num, row, None
+        except csv.Error as e:
+            yield reader.line_num, None, f"невалиден CSV: {e}"
+        return
+
+    for line_no, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"невалиден JSON: {e.msg}"
+            continue
+        if not isinstance(data, dict):
+            yield line_no, None, "редът трябва да е JSON обект"
+            continue
+        yield line_no, data, None
+
+
+# === Писане ===
+# Генератор на готови редове - записите не се събират в един документ.
+def iter_export(schedules: Iterable[Schedule], fmt: str) -> Iterator[str]:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for msg in schedules:
+            writer.writerow(["" if getattr(msg, name) is None else getattr(msg, name) for name in EXPORT_FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        return
+
+    for msg in schedules:
+        yield json.dumps(msg.to_dict(), ensure_ascii=False) + "\n"
+
+
+# === Офлайн CLI ===
+# Работи директно върху SQLite базата, докато ботът е спрян:
+#   python bulk.py import schedules.csv --guild 456 --channel 123
+#   python bulk.py export - --format jsonl --status active [--guild 456]
+async def run_import(args) -> int:
+    from storage import SqliteStore
+
+    store = SqliteStore(args.db)
+    existing = {Schedule.from_storage(p).id for p in (await store.load_guild(args.guild)).values()}
+    fmt = args.format or detect_format(args.file)
+    if fmt is None:
+        print("❌ Неизвестен формат - подайте --format", file=sys.stderr)
+        return 2
+
+    imported, failed, batch = 0, 0, []
+    with open(args.file, encoding="utf-8-sig", newline="") as fp:
+        for line_no, row, error in iter_rows(fp, fmt):
+            if error is None:
+                try:
+                    msg = build_schedule(row, existing.__contains__, args.channel, args.creator, args.guild)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                failed += 1
+                print(f"ред {line_no}: {error}", file=sys.stderr)
+                continue
+            existing.add(msg.id)
+            batch.append((msg.key, msg.to_storage()))
+            if msg.active:
+                store.set_guild_active(args.guild, True)
+            if len(batch) >= args.batch_size:
+                store.upsert_many(batch)
+                await store.flush()
+                imported += len(batch)
+                batch = []
+    if batch:
+        store.upsert_many(batch)
+        await store.flush()
+        imported += len(batch)
+    store.close()
+    print(f"✅ Импортирани: {imported}, грешки: {failed}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+async def run_export(args) -> int:
+    from storage import SqliteStore
+
+    store = SqliteStore(args.db)
+    # Ред по ред от курсора - без зареждане на цялата таблица в паметта
+    schedules = (Schedule.from_storage(payload) for _, payload in store.iter_payloads(args.guild))
+    if args.status:
+        schedules = (msg for msg in schedules if msg.status == args.status)
+    out = sys.stdout if args.file == "-" else open(args.file, "w", encoding="utf-8", newline="")
+    try:
+        for chunk in iter_export(schedules, args.format):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        store.close()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Масов импорт/експорт на автоматичните съобщения")
+    parser.add_argument("--db", default="active_messages.db", help="път до SQLite базата (MESSAGES_DB)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="импорт от JSONL или CSV")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--guild", type=int, required=True, help="guild (сървър), в който отиват графиците")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--channel", type=int, help="канал по подразбиране за редове без channel_id")
+    import_parser.add_argument("--creator", default="import")
+    import_parser.add_argument("--batch-size", type=int, default=500)
+
+    export_parser = commands.add_parser("export", help="експорт към JSONL или CSV (- за stdout)")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    export_parser.add_argument("--status", choices=tuple(STATUSES))
+    export_parser.add_argument("--guild", type=int, help="само графиците на този guild")
+
+    args = parser.parse_args()
+    return asyncio.run(run_import(args) if args.command == "import" else run_export(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from storage import ScheduleStore
+
+log = logging.getLogger("amb.cluster")
+
+
+def _weight(worker_id: str, key: int) -> int:
+    digest = hashlib.blake2b(f"{worker_id}:{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def rendezvous_owner(key: int, workers: List[str]) -> Optional[str]:
+    # Rendezvous (HRW) хеширане: при отпадане на процес се местят само
+    # неговите ключове, останалите не сменят собственика си
+    if not workers:
+        return None
+    return max(workers, key=lambda worker_id: _weight(worker_id, key))
+
+
+# === Член на клъстера ===
+# Всички процеси споделят SQLite базата. Всеки процес:
+#   - пише heartbeat в workers на heartbeat_interval секунди;
+#   - смята за живи процесите с heartbeat в последните lease секунди;
+#   - изпраща само графиците на каналите, чийто собственик е (по канал);
+#   - чете журнала changes и презарежда промените, направени от другите.
+# Slash командите пишат в базата, където и да пристигнат; собственикът
+# вижда реда в журнала и пренарежда графика при себе си. Собственикът пише
+# фазата/броя изпращания с условен UPDATE извън журнала (update_runtime),
+# така че не може да върне изтрит или спрян междувременно график.
+class ClusterMember:
+    def __init__(
+        self,
+        store: ScheduleStore,
+        worker_id: str,
+        on_changes: Callable[[Dict[str, Optional[str]]], None],
+        on_rebalance: Callable[[], Awaitable[None]],
+        lease: float = 15.0,
+        heartbeat_interval: float = 5.0,
+        poll_interval: float = 1.0,
+        changes_retention: float = 3600.0,
+        clock: Callable[[], float] = time.time
+    ):
+        self.store = store
+        self.worker_id = worker_id
+        self.on_changes = on_changes
+        self.on_rebalance = on_rebalance
+        self.lease = lease
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.changes_retention = changes_retention
+        self.clock = clock
+        self.workers: List[str] = [worker_id]
+        self._owners: Dict[int, Optional[str]] = {}
+        self._seq = 0
+        self._last_heartbeat = 0.0
+        self._last_prune = 0.0
+        self._runner: Optional[asyncio.Task] = None
+
+    def owner(self, channel_id: Optional[int]) -> Optional[str]:
+        key = channel_id or 0
+        owner = self._owners.get(key)
+        if owner is None:
+            owner = self._owners[key] = rendezvous_owner(key, self.workers)
+        return owner
+
+    def owns(self, channel_id: Optional[int]) -> bool:
+        return self.owner(channel_id) == self.worker_id
+
+    async def join(self) -> None:
+        # Позицията в журнала се взима преди зареждането на графиците, така
+        # че промени по време на load_all не се губят (в най-лошия случай
+        # се прилагат два пъти)
+        self._seq = await self.store.last_change_seq()
+        self.store.change_origin = self.worker_id
+        await self._heartbeat()
+        # Изчакваме един heartbeat цикъл: останалите процеси ни виждат и
+        # освобождават нашите канали, преди да заредим и пуснем графиците
+        await asyncio.sleep(self.heartbeat_interval * 1.5)
+        await self._heartbeat()
+        await self._refresh_workers()
+        log.info(f"🧩 Клъстер: {self.worker_id} се присъедини", extra={"workers": self.workers})
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        # Доброволно напускане - останалите поемат веднага, без да чакат lease
+        await self.store.leave(self.worker_id)
+
+    async def _heartbeat(self) -> None:
+        self._last_heartbeat = self.clock()
+        await self.store.heartbeat(self.worker_id, self._last_heartbeat)
+
+    async def _refresh_workers(self) -> bool:
+        workers = await self.store.live_workers(self.clock() - self.lease)
+        if self.worker_id not in workers:
+            workers = sorted(workers + [self.worker_id])
+        if workers == self.workers:
+            return False
+        log.info("🧩 Клъстер: нов състав", extra={"workers": workers, "previous": self.workers})
+        self.workers = workers
+        self._owners.clear()
+        return True
+
+    async def poll(self) -> None:
+        if self.clock() - self._last_heartbeat >= self.heartbeat_interval:
+            await self._heartbeat()
+            if await self._refresh_workers():
+                await self.on_rebalance()
+
+        changes = await self.store.changes_since(self._seq)
+        if changes:
+            self._seq = changes[-1][0]
+            keys = list({key for _, key, origin in changes if origin != self.worker_id})
+            if keys:
+                payloads = await self.store.load_many(keys)
+                # Липсващ ред = изтрит график
+                self.on_changes({key: payloads.get(key) for key in keys})
+
+        if time.time() - self._last_prune >= self.changes_retention / 10:
+            self._last_prune = time.time()
+            await self.store.prune_changes(self._last_prune - self.changes_retention)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"❌ Грешка в клъстерния цикъл: {e}")
+            await asyncio.sleep(self.poll_interval)
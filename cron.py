@@ -0,0 +1,252 @@
+import calendar
+import functools
+import math
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+DAY_NAMES = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+    "@weekdays": "0 9 * * 1-5"
+}
+# Ограничение на търсенето (месеци напред) - стига за 29 февруари
+MAX_MONTHS_AHEAD = 12 * 9
+
+
+def _next_bit(mask: int, start: int) -> int:
+    # Най-малкият вдигнат бит >= start или -1
+    rest = mask >> start
+    if not rest:
+        return -1
+    return start + (rest & -rest).bit_length() - 1
+
+
+def _parse_value(token: str, names: dict, low: int, high: int) -> int:
+    token = token.lower()
+    if token in names:
+        return names[token]
+    if not token.isdigit():
+        raise ValueError(f"Невалидна стойност '{token}'")
+    value = int(token)
+    if not low <= value <= high:
+        raise ValueError(f"Стойността {value} е извън {low}-{high}")
+    return value
+
+
+def _parse_field(field: str, low: int, high: int, names: dict = {}) -> Tuple[int, bool]:
+    # Връща (битова маска, ограничено ли е полето)
+    mask = 0
+    for part in field.split(","):
+        body, _, step_text = part.partition("/")
+        step = 1
+        if step_text:
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise ValueError(f"Невалидна стъпка '{step_text}'")
+            step = int(step_text)
+        if body == "*":
+            start, end = low, high
+        elif "-" in body:
+            first, _, last = body.partition("-")
+            start, end = _parse_value(first, names, low, high), _parse_value(last, names, low, high)
+            if start > end:
+                raise ValueError(f"Обратен диапазон '{body}'")
+        else:
+            start = _parse_value(body, names, low, high)
+            end = high if step_text else start
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask, field != "*"
+
+
+# === Компилиран cron израз ===
+# Полетата са битови маски; дните от месеца се смятат като маска за двойката
+# (ден от седмицата на 1-во число, дължина на месеца) - най-много 28
+# комбинации, кеширани в израза. Следващото време се намира с търсене на
+# следващ вдигнат бит по месец -> ден -> час -> минута, без обхождане на
+# минути. Времената са абсолютни (UTC timestamp), изчислени в зоната на израза.
+class CronExpr:
+    __slots__ = (
+        "expr",
+        "tz_name",
+        "tz",
+        "minutes",
+        "hours",
+        "days",
+        "months",
+        "weekdays",
+        "nth_weekdays",
+        "last_weekdays",
+        "last_day",
+        "dom_restricted",
+        "dow_restricted",
+        "_month_masks"
+    )
+
+    def __init__(self, expr: str, tz_name: Optional[str] = None):
+        self.expr = expr.strip()
+        self.tz_name = tz_name or None
+        try:
+            self.tz = ZoneInfo(tz_name) if tz_name else timezone.utc
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Непозната часова зона '{tz_name}'")
+
+        fields = ALIASES.get(self.expr.lower(), self.expr).split()
+        if len(fields) != 5:
+            raise ValueError("Cron изразът трябва да има 5 полета: минута час ден месец ден_от_седмицата")
+        minute, hour, dom, month, dow = fields
+        self.minutes, _ = _parse_field(minute, 0, 59)
+        self.hours, _ = _parse_field(hour, 0, 23)
+        self.months, _ = _parse_field(month, 1, 12, MONTH_NAMES)
+
+        # "L" = последен ден от месеца
+        dom_parts = dom.upper().split(",")
+        self.last_day = "L" in dom_parts
+        rest = ",".join(p for p in dom_parts if p != "L")
+        self.days, _ = _parse_field(rest, 1, 31) if rest else (0, True)
+        self.dom_restricted = dom != "*"
+
+        # "1#1" = първи понеделник, "5L" = последен петък
+        self.nth_weekdays: List[Tuple[int, int]] = []
+        self.last_weekdays: List[int] = []
+        plain = []
+        for part in dow.lower().split(","):
+            if "#" in part:
+                day, _, nth = part.partition("#")
+                if not nth.isdigit() or not 1 <= int(nth) <= 5:
+                    raise ValueError(f"Невалиден пореден номер '{part}'")
+                self.nth_weekdays.append((_parse_value(day, DAY_NAMES, 0, 7) % 7, int(nth)))
+            elif part.endswith("l") and len(part) > 1:
+                self.last_weekdays.append(_parse_value(part[:-1], DAY_NAMES, 0, 7) % 7)
+            else:
+                plain.append(part)
+        weekdays = 0
+        if plain:
+            weekdays, _ = _parse_field(",".join(plain), 0, 7, DAY_NAMES)
+            if weekdays & (1 << 7):
+                weekdays = (weekdays | 1) & 0x7F
+        self.weekdays = weekdays
+        self.dow_restricted = dow != "*"
+
+        self._month_masks = {}
+        if not (self.minutes and self.hours and self.months):
+            raise ValueError("Празен cron израз")
+
+    def __repr__(self) -> str:
+        return f"<CronExpr {self.expr!r} tz={self.tz_name or 'UTC'}>"
+
+    def _month_mask(self, first_dow: int, length: int) -> int:
+        key = first_dow * 32 + length
+        mask = self._month_masks.get(key)
+        if mask is not None:
+            return mask
+
+        dom_mask = self.days & ((1 << (length + 1)) - 2)
+        if self.last_day:
+            dom_mask |= 1 << length
+        dow_mask = 0
+        for day in range(1, length + 1):
+            if self.weekdays >> ((first_dow + day - 1) % 7) & 1:
+                dow_mask |= 1 << day
+        for weekday, nth in self.nth_weekdays:
+            day = 1 + (weekday - first_dow) % 7 + 7 * (nth - 1)
+            if day <= length:
+                dow_mask |= 1 << day
+        for weekday in self.last_weekdays:
+            dow_mask |= 1 << (length - (first_dow + length - 1 - weekday) % 7)
+
+        # Както в cron: при два ограничени полета денят е ИЛИ, иначе важи ограниченото
+        if self.dom_restricted and self.dow_restricted:
+            mask = dom_mask | dow_mask
+        elif self.dom_restricted:
+            mask = dom_mask
+        elif self.dow_restricted:
+            mask = dow_mask
+        else:
+            mask = (1 << (length + 1)) - 2
+        self._month_masks[key] = mask
+        return mask
+
+    def next_after(self, ts: float) -> Optional[float]:
+        # Първото съвпадение строго след ts (на границата на минута)
+        start = (math.floor(ts / 60) + 1) * 60
+        local = datetime.fromtimestamp(start, self.tz)
+        year, month, day, hour, minute = local.year, local.month, local.day, local.hour, local.minute
+        months_checked = 0
+
+        while months_checked <= MAX_MONTHS_AHEAD:
+            next_month = _next_bit(self.months, month)
+            if next_month != month:
+                months_checked += 1
+                if next_month < 0:
+                    year += 1
+                    next_month = _next_bit(self.months, 1)
+                month, day, hour, minute = next_month, 1, 0, 0
+
+            first_dow, length = calendar.monthrange(year, month)
+            next_day = _next_bit(self._month_mask((first_dow + 1) % 7, length), day)
+            if next_day < 0:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                months_checked += 1
+                continue
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+
+            next_hour = _next_bit(self.hours, hour)
+            if next_hour < 0:
+                day, hour, minute = day + 1, 0, 0
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+
+            next_minute = _next_bit(self.minutes, minute)
+            if next_minute < 0:
+                hour, minute = hour + 1, 0
+                continue
+
+            fire_at = datetime(year, month, day, hour, next_minute, tzinfo=self.tz).timestamp()
+            if fire_at > ts:
+                return fire_at
+            # Повторен час при смяна на лятното време - продължаваме напред
+            minute = next_minute + 1
+            if minute > 59:
+                hour, minute = hour + 1, 0
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_cron(expr: str, tz_name: Optional[str] = None) -> CronExpr:
+    # Графиците с еднакъв израз и зона споделят един компилиран обект
+    cron = CronExpr(expr, tz_name)
+    if cron.next_after(datetime.now(timezone.utc).timestamp()) is None:
+        raise ValueError(f"Cron изразът '{expr}' никога не съвпада")
+    return cron
+
+
+# === Текстово поле "интервал или cron" (EditModal) ===
+# "60" -> интервал в минути; "CRON_TZ=Europe/Sofia 0 9 * * 1-5" -> cron в зона.
+def format_schedule_spec(interval: int, cron: Optional[str], tz_name: Optional[str]) -> str:
+    if not cron:
+        return str(interval)
+    return f"CRON_TZ={tz_name} {cron}" if tz_name else cron
+
+
+def parse_schedule_spec(text: str, default_tz: Optional[str] = None) -> Tuple[int, Optional[str], Optional[str]]:
+    text = text.strip()
+    if text.isdigit():
+        return int(text), None, None
+    tz_name = default_tz
+    if text.upper().startswith(("CRON_TZ=", "TZ=")):
+        prefix, _, text = text.partition(" ")
+        tz_name = prefix.partition("=")[2]
+    compile_cron(text.strip(), tz_name)
+    return 0, text.strip(), tz_name
@@ -0,0 +1,367 @@
+import asyncio
+import contextlib
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+
+# === Token bucket за един канал ===
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        # Връща 0, ако има жетон, иначе колко секунди да се чака
+        now = self.clock()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float) -> None:
+        # След 429 каналът е блокиран за retry_after и кофата се изпразва
+        now = self.clock()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = max(now, self.blocked_until)
+
+
+# === Общ лимит на едновременните заявки, раздаван на кръг между групите ===
+# Докато има свободни слотове, всеки ги взима веднага. Когато всички са заети,
+# освободеният слот отива директно при следващата група с чакащи (round
+# robin), а не при най-ранно дошлия - натоварен guild с много канали не може
+# да заеме опашката, но и не е ограничен, когато другите не пращат нищо.
+class FairSlots:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+
+    async def acquire(self, group: Hashable) -> None:
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(group, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слотът вече беше предаден - връщаме го
+                self.release()
+            else:
+                queue = self._waiters.get(group)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiters[group]
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            group = next(iter(self._waiters))
+            queue = self._waiters.pop(group)
+            future = queue.popleft()
+            if queue:
+                # Групата отива в края на реда
+                self._waiters[group] = queue
+            if not future.done():
+                # Слотът се предава директно, in_use не се променя
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+
+class PendingSend:
+    __slots__ = ("content", "msg_ids", "identity", "attempts")
+
+    def __init__(self, content: str, msg_ids: List[Hashable], identity: Optional[Hashable] = None, attempts: int = 0):
+        self.content = content
+        self.msg_ids = msg_ids
+        # Допълнителни параметри към send (напр. име/аватар на webhook)
+        self.identity = identity
+        # Брой неуспешни опити досега
+        self.attempts = attempts
+
+
+class Reroute(Exception):
+    # send хвърля Reroute(друг диспечер), когато съобщението трябва да мине
+    # по друг път (напр. webhook -> channel.send на бота): пакетът отива в
+    # опашката на target със същите ID-та и група и спазва неговите лимити
+    def __init__(self, target: "SendDispatcher"):
+        super().__init__("reroute")
+        self.target = target
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    return getattr(exc, "status", None) == 429 or type(exc).__name__ == "RateLimited"
+
+
+# === Класификация на грешките при изпращане ===
+# Преходни (повтарят се с backoff): 429, 5xx, timeout и прекъсната връзка.
+# Постоянни (без повторение): всички останали - 403 Missing Access, 404
+# Unknown Channel, липсващ канал, невалидно съдържание и т.н.
+ERROR_RATE_LIMITED = "rate_limited"
+ERROR_TRANSIENT = "transient"
+ERROR_PERMANENT = "permanent"
+
+# По име, за да не зависи диспечерът от aiohttp/discord.py
+_TRANSIENT_ERROR_TYPES = {"ClientConnectionError", "ClientPayloadError", "DiscordServerError"}
+
+
+def classify_error(exc: Exception) -> str:
+    if is_rate_limited(exc):
+        return ERROR_RATE_LIMITED
+    status = getattr(exc, "status", None)
+    if isinstance(status, int):
+        return ERROR_TRANSIENT if status >= 500 or status == 408 else ERROR_PERMANENT
+    # TimeoutError и ConnectionError са OSError
+    if isinstance(exc, OSError) or any(cls.__name__ in _TRANSIENT_ERROR_TYPES for cls in type(exc).__mro__):
+        return ERROR_TRANSIENT
+    return ERROR_PERMANENT
+
+
+# === Диспечер за изпращане ===
+# Опашка и token bucket за всеки канал; един worker на канал, само докато
+# опашката му не е празна. send(channel_id, content[, identity]) - identity
+# се подава само ако е зададена при submit. Преходните грешки (classify_error)
+# се повтарят до max_retries пъти с експоненциален backoff и jitter (при 429 -
+# поне retry_after и целият канал се блокира). Повторението чака в отделна
+# задача, а worker-ът продължава с останалите съобщения. Окончателният отказ
+# стига до on_failed с флаг дали грешката е постоянна. По желание съобщенията, чакащи за един канал, се
+# обединяват в едно изпращане до max_length символа.
+# Справедливост между групи (guild-ове): едновременните заявки са най-много
+# max_in_flight общо, раздавани на кръг между групите (FairSlots). По желание
+# и твърд лимит group_in_flight на група.
+class SendDispatcher:
+    def __init__(
+        self,
+        send: Callable[..., Awaitable[object]],
+        rate: float = 1.0,
+        burst: float = 5,
+        coalesce: bool = False,
+        max_length: int = 2000,
+        max_retries: int = 5,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        max_in_flight: int = 0,
+        group_in_flight: int = 0,
+        timeout: float = 0,
+        on_sent: Optional[Callable[[List[Hashable], int], None]] = None,
+        on_failed: Optional[Callable[[List[Hashable], int, Exception, bool], None]] = None,
+        on_retry: Optional[Callable[[List[Hashable], int, Exception, int], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._send = send
+        self.rate = rate
+        self.burst = burst
+        self.coalesce = coalesce
+        self.max_length = max_length
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_in_flight = max_in_flight
+        self.group_in_flight = group_in_flight
+        # Таймаут на една заявка (0 = без); изтичането е преходна грешка
+        self.timeout = timeout
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.on_retry = on_retry
+        self.clock = clock
+        self._queues: Dict[int, Deque[PendingSend]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._channel_groups: Dict[int, Hashable] = {}
+        self._group_slots: Dict[Hashable, asyncio.Semaphore] = {}
+        self._slots = FairSlots(max_in_flight) if max_in_flight else None
+        self._retries: Set[asyncio.Task] = set()
+        self.sent = 0
+        self.rate_limited = 0
+        self.retried = 0
+        self.failed = 0
+
+    def pending(self, channel_id: Optional[int] = None) -> int:
+        if channel_id is not None:
+            return len(self._queues.get(channel_id, ()))
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def retrying(self) -> int:
+        return len(self._retries)
+
+    def submit(
+        self,
+        channel_id: int,
+        content: str,
+        msg_id: Optional[Hashable] = None,
+        group: Optional[Hashable] = None,
+        identity: Optional[Hashable] = None
+    ) -> None:
+        if group is not None:
+            self._channel_groups[channel_id] = group
+        self._enqueue(channel_id, PendingSend(content, [msg_id] if msg_id is not None else [], identity))
+
+    def submit_batch(self, channel_id: int, content: str, msg_ids: List[Hashable], group: Optional[Hashable] = None) -> None:
+        # Вече обединено съдържание с всичките му ID-та (виж Reroute)
+        if group is not None:
+            self._channel_groups[channel_id] = group
+        self._enqueue(channel_id, PendingSend(content, list(msg_ids)))
+
+    def _enqueue(self, channel_id: int, item: PendingSend, first: bool = False) -> None:
+        queue = self._queues.get(channel_id)
+        if queue is None:
+            queue = self._queues[channel_id] = deque()
+        if first:
+            queue.appendleft(item)
+        else:
+            queue.append(item)
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._worker(channel_id))
+
+    def _bucket(self, channel_id: int) -> TokenBucket:
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(self.rate, self.burst, self.clock)
+        return bucket
+
+    @contextlib.asynccontextmanager
+    async def _in_flight(self, channel_id: int):
+        group_slot = None
+        group = self._channel_groups.get(channel_id)
+        if self.group_in_flight and group is not None:
+            group_slot = self._group_slots.get(group)
+            if group_slot is None:
+                group_slot = self._group_slots[group] = asyncio.Semaphore(self.group_in_flight)
+        if group_slot is not None:
+            await group_slot.acquire()
+        try:
+            if self._slots is not None:
+                # Канал без група е сам в своята група
+                await self._slots.acquire(channel_id if group is None else group)
+            try:
+                yield
+            finally:
+                if self._slots is not None:
+                    self._slots.release()
+        finally:
+            if group_slot is not None:
+                group_slot.release()
+
+    def _next_batch(self, queue: Deque[PendingSend]) -> PendingSend:
+        item = queue.popleft()
+        if not self.coalesce:
+            return item
+        parts = [item.content]
+        msg_ids = list(item.msg_ids)
+        length = len(item.content)
+        # Обединяват се само съобщения с еднаква identity (едно име/аватар)
+        while queue and queue[0].identity == item.identity and length + 1 + len(queue[0].content) <= self.max_length:
+            nxt = queue.popleft()
+            parts.append(nxt.content)
+            msg_ids.extend(nxt.msg_ids)
+            length += 1 + len(nxt.content)
+        return PendingSend("\n".join(parts), msg_ids, item.identity, item.attempts)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay + random.uniform(0, delay * 0.1)
+
+    async def _worker(self, channel_id: int) -> None:
+        queue = self._queues[channel_id]
+        bucket = self._bucket(channel_id)
+        cancelled = False
+        try:
+            while queue:
+                wait = bucket.take()
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = bucket.take()
+                batch = self._next_batch(queue)
+                await self._deliver(channel_id, bucket, batch)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            del self._workers[channel_id]
+            if self._queues.get(channel_id) is not queue:
+                # stop() изчисти опашките; submit след това създава нова
+                if channel_id in self._queues:
+                    self._workers[channel_id] = asyncio.create_task(self._worker(channel_id))
+            elif queue and not cancelled:
+                # Нови елементи пристигнаха по време на отказ - продължаваме
+                self._workers[channel_id] = asyncio.create_task(self._worker(channel_id))
+            else:
+                # Отказан worker не се рестартира - чакащите за канала отпадат
+                del self._queues[channel_id]
+
+    async def _deliver(self, channel_id: int, bucket: TokenBucket, batch: PendingSend) -> None:
+        try:
+            # Слотът се държи само за самата заявка, не и по време на backoff
+            async with self._in_flight(channel_id):
+                if batch.identity is None:
+                    request = self._send(channel_id, batch.content)
+                else:
+                    request = self._send(channel_id, batch.content, batch.identity)
+                if self.timeout:
+                    await asyncio.wait_for(request, self.timeout)
+                else:
+                    await request
+        except asyncio.CancelledError:
+            raise
+        except Reroute as e:
+            e.target.submit_batch(channel_id, batch.content, batch.msg_ids, self._channel_groups.get(channel_id))
+            return
+        except Exception as e:
+            kind = classify_error(e)
+            if kind != ERROR_PERMANENT and batch.attempts < self.max_retries:
+                if kind == ERROR_RATE_LIMITED:
+                    self.rate_limited += 1
+                    delay = self._backoff(batch.attempts, getattr(e, "retry_after", None))
+                    bucket.block(delay)
+                else:
+                    self.retried += 1
+                    delay = self._backoff(batch.attempts, None)
+                batch.attempts += 1
+                if self.on_retry:
+                    self.on_retry(batch.msg_ids, channel_id, e, batch.attempts)
+                task = asyncio.create_task(self._retry_later(channel_id, batch, delay))
+                self._retries.add(task)
+                task.add_done_callback(self._retries.discard)
+                return
+            self.failed += 1
+            if self.on_failed:
+                self.on_failed(batch.msg_ids, channel_id, e, kind == ERROR_PERMANENT)
+            return
+        self.sent += 1
+        if self.on_sent:
+            self.on_sent(batch.msg_ids, channel_id)
+
+    async def _retry_later(self, channel_id: int, batch: PendingSend, delay: float) -> None:
+        await asyncio.sleep(delay)
+        # Повторният опит е пред новите съобщения за канала
+        self._enqueue(channel_id, batch, first=True)
+
+    async def drain(self) -> None:
+        while self._workers or self._retries:
+            await asyncio.gather(*list(self._workers.values()), *list(self._retries), return_exceptions=True)
+
+    def stop(self) -> None:
+        # Спира и чакащите съобщения, и отложените повторения
+        self._queues.clear()
+        for task in list(self._workers.values()) + list(self._retries):
+            task.cancel()
@@ -0,0 +1,58 @@
+import asyncio
+import json
+from typing import Iterable, Optional
+
+from index import ScheduleIndex
+from models import STATUS_ACTIVE
+
+
+# === Настройки на guild ===
+# Каналът по подразбиране, ролите с достъп и квотата за брой графици.
+# Празни role_ids = ролите по име от ALLOWED_ROLES; quota None = GUILD_QUOTA.
+class GuildConfig:
+    __slots__ = ("channel_id", "role_ids", "quota")
+
+    def __init__(self, channel_id: Optional[int] = None, role_ids: Iterable[int] = (), quota: Optional[int] = None):
+        self.channel_id = int(channel_id) if channel_id else None
+        self.role_ids = frozenset(int(r) for r in role_ids)
+        self.quota = int(quota) if quota is not None else None
+
+    def __repr__(self) -> str:
+        return f"<GuildConfig channel_id={self.channel_id} roles={len(self.role_ids)} quota={self.quota}>"
+
+    def to_storage(self) -> str:
+        return json.dumps({"channel_id": self.channel_id, "role_ids": sorted(self.role_ids), "quota": self.quota})
+
+    @classmethod
+    def from_storage(cls, payload: Optional[str]) -> "GuildConfig":
+        if not payload:
+            return cls()
+        data = json.loads(payload)
+        return cls(data.get("channel_id"), data.get("role_ids") or (), data.get("quota"))
+
+
+# === Дял на един guild ===
+# Собствен индекс (ID-тата са уникални само в guild-а) и настройки. Дялът се
+# зарежда от хранилището при старт, ако има активни графици, иначе при първата
+# команда от guild-а; lock-ът пази от двойно зареждане при паралелни команди.
+class GuildState:
+    __slots__ = ("guild_id", "config", "index", "loaded", "active", "lock")
+
+    def __init__(self, guild_id: int, active: bool = False):
+        self.guild_id = guild_id
+        self.config = GuildConfig()
+        self.index = ScheduleIndex()
+        self.loaded = False
+        # Последно записаният флаг "има активни графици"
+        self.active = active
+        self.lock = asyncio.Lock()
+
+    def __repr__(self) -> str:
+        return f"<GuildState guild_id={self.guild_id} schedules={len(self.index)} loaded={self.loaded}>"
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def has_active(self) -> bool:
+        return bool(self.index.by_status.get(STATUS_ACTIVE))
@@ -0,0 +1,175 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+
+def _prefix_end(prefix: str) -> str:
+    # Най-малкият низ, по-голям от всички с този префикс
+    return prefix + "\U0010ffff"
+
+
+# === Префиксен индекс на ID-тата ===
+# Сортиран списък от същите str обекти, които са ключове в active_messages:
+# префиксът е интервал [bisect(prefix), bisect(prefix + max)), т.е.
+# O(log n + k) като обхождане на trie, но без възел на символ.
+class PrefixIndex:
+    def __init__(self):
+        self._ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, key: str) -> None:
+        i = bisect_left(self._ids, key)
+        if i == len(self._ids) or self._ids[i] != key:
+            self._ids.insert(i, key)
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        # Timsort слива вече сортирания списък с новите за O(n)
+        self._ids.extend(keys)
+        self._ids.sort()
+
+    def remove(self, key: str) -> None:
+        i = bisect_left(self._ids, key)
+        if i < len(self._ids) and self._ids[i] == key:
+            del self._ids[i]
+
+    def clear(self) -> None:
+        self._ids.clear()
+
+    def range(self, prefix: str = "") -> Tuple[int, int]:
+        if not prefix:
+            return 0, len(self._ids)
+        return bisect_left(self._ids, prefix), bisect_left(self._ids, _prefix_end(prefix))
+
+    def all(self, prefix: str = "") -> List[str]:
+        start, end = self.range(prefix)
+        return self._ids[start:end]
+
+    def complete(self, prefix: str, limit: int = 25, accept: Optional[Callable[[str], bool]] = None, scan_limit: int = 500) -> List[str]:
+        start, end = self.range(prefix)
+        if accept is None:
+            return self._ids[start:min(end, start + limit)]
+        result = []
+        for key in self._ids[start:min(end, start + scan_limit)]:
+            if accept(key):
+                result.append(key)
+                if len(result) >= limit:
+                    break
+        return result
+
+
+# === Вторични индекси по канал, създател и статус ===
+# Поддържат се от save_message (единствената точка за промени), така че
+# create, EditModal, бутоните и /import ги обновяват без отделен код.
+# За всяко ID се пазят последно индексираните стойности - повторен запис
+# без промяна (напр. след всяко изпращане) е една проверка в dict.
+class ScheduleIndex:
+    def __init__(self):
+        self.ids = PrefixIndex()
+        self.by_channel: Dict[Optional[int], Set[str]] = {}
+        self.by_creator: Dict[str, Set[str]] = {}
+        self.by_status: Dict[str, Set[str]] = {}
+        self._keys: Dict[str, Tuple[Optional[int], str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, msg_id: str) -> bool:
+        return msg_id in self._keys
+
+    @staticmethod
+    def _add_to(index: Dict[Hashable, Set[str]], key: Hashable, msg_id: str) -> None:
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = set()
+        bucket.add(msg_id)
+
+    @staticmethod
+    def _remove_from(index: Dict[Hashable, Set[str]], key: Hashable, msg_id: str) -> None:
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(msg_id)
+            if not bucket:
+                del index[key]
+
+    def update(self, msg_id: str, channel_id: Optional[int], creator: str, status: str, new: bool = True) -> None:
+        keys = (channel_id, creator, status)
+        old = self._keys.get(msg_id)
+        if old == keys:
+            return
+        if old is None:
+            if new:
+                self.ids.add(msg_id)
+        else:
+            self._remove_from(self.by_channel, old[0], msg_id)
+            self._remove_from(self.by_creator, old[1], msg_id)
+            self._remove_from(self.by_status, old[2], msg_id)
+        self._keys[msg_id] = keys
+        self._add_to(self.by_channel, channel_id, msg_id)
+        self._add_to(self.by_creator, creator, msg_id)
+        self._add_to(self.by_status, status, msg_id)
+
+    def update_many(self, items: Iterable[Tuple[str, Optional[int], str, str]]) -> None:
+        added = []
+        for msg_id, channel_id, creator, status in items:
+            if msg_id not in self._keys:
+                added.append(msg_id)
+            self.update(msg_id, channel_id, creator, status, new=False)
+        self.ids.add_many(added)
+
+    def remove(self, msg_id: str) -> None:
+        old = self._keys.pop(msg_id, None)
+        if old is None:
+            return
+        self.ids.remove(msg_id)
+        self._remove_from(self.by_channel, old[0], msg_id)
+        self._remove_from(self.by_creator, old[1], msg_id)
+        self._remove_from(self.by_status, old[2], msg_id)
+
+    def clear(self) -> None:
+        self.ids.clear()
+        self.by_channel.clear()
+        self.by_creator.clear()
+        self.by_status.clear()
+        self._keys.clear()
+
+    def rebuild(self, items: Iterable[Tuple[str, Optional[int], str, str]]) -> None:
+        self.clear()
+        self.update_many(items)
+
+    def query(
+        self,
+        status: Optional[str] = None,
+        channel_id: Optional[int] = None,
+        creator: Optional[str] = None,
+        prefix: Optional[str] = None
+    ) -> List[str]:
+        # Сечение на множествата, започвайки от най-малкото; резултатът е сортиран
+        sets = []
+        if status:
+            sets.append(self.by_status.get(status, set()))
+        if channel_id:
+            sets.append(self.by_channel.get(channel_id, set()))
+        if creator:
+            sets.append(self.by_creator.get(creator, set()))
+        if not sets:
+            return self.ids.all(prefix or "")
+
+        sets.sort(key=len)
+        result = sets[0]
+        for other in sets[1:]:
+            result = result & other
+            if not result:
+                return []
+        start, end = self.ids.range(prefix or "")
+        if prefix and end - start < len(result):
+            return [msg_id for msg_id in self.ids.all(prefix) if msg_id in result]
+        if prefix:
+            return sorted(msg_id for msg_id in result if msg_id.startswith(prefix))
+        return sorted(result)
+
+    def complete(self, prefix: str, limit: int = 25, status: Optional[str] = None) -> List[str]:
+        if status is None:
+            return self.ids.complete(prefix, limit)
+        matching = self.by_status.get(status, set())
+        return self.ids.complete(prefix, limit, accept=matching.__contains__)
@@ -0,0 +1,111 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+# Полета, които не са част от стандартния LogRecord, а идват от extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+# === Формат ===
+# Един JSON обект на ред. extra полетата (schedule_id, channel_id, ...)
+# се добавят като ключове от първо ниво.
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    converter = time.gmtime
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = [f"{k}={v}" for k, v in record.__dict__.items() if k not in _RECORD_FIELDS and not k.startswith("_")]
+        return f"{line} [{' '.join(extra)}]" if extra else line
+
+
+# === Семплиране ===
+# Записи под WARNING от изброените логъри минават с дадената вероятност;
+# предупрежденията и грешките винаги минават.
+class SampleFilter(logging.Filter):
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.name)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+# === Опашка ===
+# На event loop-а остава само проверката на нивото и getMessage();
+# форматирането и писането са в нишката на QueueListener.
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    # "discord.gateway=WARNING,discord.http=ERROR"
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+
+def setup_logging(
+    level: str = "INFO",
+    logger_levels: str = "",
+    fmt: str = "json",
+    sample_rates: Optional[Dict[str, float]] = None,
+    stream=sys.stdout
+) -> logging.handlers.QueueListener:
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    if sample_rates:
+        handler.addFilter(SampleFilter(sample_rates))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root_level = logging.getLevelName(level.upper())
+    root.setLevel(root_level if isinstance(root_level, int) else logging.INFO)
+    for name, logger_level in parse_levels(logger_levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Опашката се изпразва преди изхода на процеса
+    atexit.register(listener.stop)
+    return listener
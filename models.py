@@ -0,0 +1,175 @@
+import json
+import sys
+from typing import Optional, Tuple
+
+STATUS_ACTIVE = sys.intern("active")
+STATUS_STOPPED = sys.intern("stopped")
+# Dead-letter: постоянна грешка при изпращане (причината е в last_error)
+STATUS_FAILED = sys.intern("failed")
+STATUSES = {STATUS_ACTIVE: STATUS_ACTIVE, STATUS_STOPPED: STATUS_STOPPED, STATUS_FAILED: STATUS_FAILED}
+MAX_ERROR_LENGTH = 200
+
+_json_decode = json.JSONDecoder().decode
+_json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+# Каналите и guild-овете са малко на брой спрямо графиците - едно int копие на ID
+_snowflakes: dict = {}
+
+
+def intern_status(status: Optional[str]) -> str:
+    return STATUSES.get(status) or sys.intern(status or STATUS_ACTIVE)
+
+
+def intern_channel_id(channel_id) -> Optional[int]:
+    if not channel_id:
+        return None
+    channel_id = int(channel_id)
+    return _snowflakes.setdefault(channel_id, channel_id)
+
+
+intern_guild_id = intern_channel_id
+
+
+# === Ключ в хранилището и планировчика ===
+# ID-тата са уникални в рамките на guild: ключът е "<guild_id>:<id>", така
+# че редовете на един guild са съседен интервал в първичния ключ на SQLite.
+def schedule_key(guild_id: Optional[int], msg_id: str) -> str:
+    return f"{guild_id or 0}:{msg_id}"
+
+
+def split_key(key: str) -> Tuple[int, str]:
+    guild_id, sep, msg_id = key.partition(":")
+    if not sep or not guild_id.isdigit():
+        # Ключ отпреди multi-guild (само ID)
+        return 0, key
+    return int(guild_id), msg_id
+
+
+# === Запис за един график ===
+# Само записваните полета, в __slots__ (без __dict__ на обект). Състоянието
+# по време на работа (позиция в планировчика, кеширани embed-и) живее
+# отделно. creator и status се интернират, channel_id е int.
+class Schedule:
+    __slots__ = (
+        "id",
+        "message",
+        "interval",
+        "repeat",
+        "creator",
+        "status",
+        "channel_id",
+        "next_fire_at",
+        "sent_count",
+        "cron",
+        "timezone",
+        "guild_id",
+        "delivery",
+        "username",
+        "avatar_url",
+        "failures",
+        "last_error"
+    )
+
+    def __init__(
+        self,
+        id: str,
+        message: str = "",
+        interval: int = 0,
+        repeat: int = 0,
+        creator: str = "",
+        status: str = STATUS_ACTIVE,
+        channel_id: Optional[int] = None,
+        next_fire_at: Optional[float] = None,
+        sent_count: int = 0,
+        cron: Optional[str] = None,
+        timezone: Optional[str] = None,
+        guild_id: Optional[int] = None,
+        delivery: Optional[str] = None,
+        username: Optional[str] = None,
+        avatar_url: Optional[str] = None,
+        failures: int = 0,
+        last_error: Optional[str] = None
+    ):
+        self.id = id
+        self.message = message or ""
+        self.interval = int(interval or 0)
+        self.repeat = int(repeat or 0)
+        self.creator = sys.intern(creator or "")
+        self.status = intern_status(status)
+        self.channel_id = intern_channel_id(channel_id)
+        self.next_fire_at = next_fire_at
+        self.sent_count = int(sent_count or 0)
+        # Cron графиците ползват общ израз/зона - интернират се като creator
+        self.cron = sys.intern(cron) if cron else None
+        self.timezone = sys.intern(timezone) if timezone else None
+        # None = запис отпреди multi-guild (мигрира се при първия старт)
+        self.guild_id = intern_guild_id(guild_id)
+        # None = channel.send от бота; "webhook" = през webhook на канала
+        # с име/аватар по избор (обикновено общи за много графици)
+        self.delivery = sys.intern(delivery) if delivery else None
+        self.username = sys.intern(username) if username else None
+        self.avatar_url = avatar_url or None
+        # Поредни неуспешни изпращания (след повторенията) и последната причина
+        self.failures = int(failures or 0)
+        self.last_error = last_error[:MAX_ERROR_LENGTH] if last_error else None
+
+    def __repr__(self) -> str:
+        return f"<Schedule id={self.id!r} guild_id={self.guild_id} status={self.status} channel_id={self.channel_id}>"
+
+    @property
+    def active(self) -> bool:
+        return self.status is STATUS_ACTIVE
+
+    @property
+    def health(self) -> str:
+        # ok / degraded (последните изпращания не успяха) / dead (dead-letter)
+        if self.status is STATUS_FAILED:
+            return "dead"
+        return "degraded" if self.failures else "ok"
+
+    @property
+    def key(self) -> str:
+        return schedule_key(self.guild_id, self.id)
+
+    # --- Кодек към хранилището ---
+    # Позиционен JSON масив в реда на __slots__; нови полета се добавят
+    # само в края, така че по-къси (стари) редове се четат с подразбиране.
+    def to_storage(self) -> str:
+        row = [
+            self.id,
+            self.message,
+            self.interval,
+            self.repeat,
+            self.creator,
+            self.status,
+            self.channel_id,
+            self.next_fire_at,
+            self.sent_count,
+            self.cron,
+            self.timezone,
+            self.guild_id,
+            self.delivery,
+            self.username,
+            self.avatar_url,
+            self.failures or None,
+            self.last_error
+        ]
+        # Празните полета в края не се записват - редът остава като стария формат
+        while row[-1] is None:
+            row.pop()
+        return _json_encode(row)
+
+    @classmethod
+    def from_storage(cls, payload: str) -> "Schedule":
+        data = _json_decode(payload)
+        if isinstance(data, dict):
+            return cls.from_dict(data)
+        return cls(*data)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Schedule":
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger("amb.scheduler")
+
+
+# === Централен планировчик ===
+# Един min-heap с (време, пореден номер, msg_id) и един dispatcher цикъл
+# вместо отделна asyncio задача за всяко съобщение. Промените (start/stop/
+# edit/delete) са O(log n): старият запис се маркира като невалиден и се
+# изхвърля мързеливо, когато стигне върха на heap-а.
+class Scheduler:
+    def __init__(
+        self,
+        on_fire: Callable[[str, float], Optional[float]],
+        clock: Callable[[], float] = time.time,
+        max_batch: int = 1000
+    ):
+        # on_fire(msg_id, when) връща следващото време за изпращане или None
+        self._on_fire = on_fire
+        self.clock = clock
+        # Най-много толкова изпълнения на едно минаване, после се отстъпва на loop-а
+        self.max_batch = max_batch
+        self._heap: List[list] = []
+        self._entries: Dict[str, list] = {}
+        self._counter = itertools.count()
+        self._stale = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, msg_id: str) -> bool:
+        return msg_id in self._entries
+
+    def now(self) -> float:
+        return self.clock()
+
+    def next_fire(self, msg_id: str) -> Optional[float]:
+        entry = self._entries.get(msg_id)
+        return entry[0] if entry else None
+
+    def schedule(self, msg_id: str, when: float) -> None:
+        self._invalidate(msg_id)
+        entry = [when, next(self._counter), msg_id]
+        self._entries[msg_id] = entry
+        previous_top = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, entry)
+        # Будим цикъла само ако новото време е преди досегашното най-ранно
+        if previous_top is None or when < previous_top:
+            self._wake()
+
+    def schedule_many(self, items: Iterable[Tuple[str, float]]) -> int:
+        # Масово вмъкване: записите се добавят в края и heap-ът се подрежда
+        # с един heapify вместо по един heappush на запис
+        added = 0
+        for msg_id, when in items:
+            self._invalidate(msg_id)
+            entry = [when, next(self._counter), msg_id]
+            self._entries[msg_id] = entry
+            self._heap.append(entry)
+            added += 1
+        if added:
+            heapq.heapify(self._heap)
+            self._wake()
+        return added
+
+    def remove(self, msg_id: str) -> None:
+        self._invalidate(msg_id)
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._entries.clear()
+        self._stale = 0
+        self._wake()
+
+    def _invalidate(self, msg_id: str) -> None:
+        entry = self._entries.pop(msg_id, None)
+        if entry is None:
+            return
+        entry[2] = None
+        self._stale += 1
+        # Прекалено много мъртви записи -> компактиране на heap-а
+        if self._stale > 1024 and self._stale > len(self._entries):
+            self._heap = [e for e in self._heap if e[2] is not None]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = self.clock()
+        fired = 0
+        heap = self._heap
+        while heap and heap[0][0] <= now and fired < self.max_batch:
+            when, _, msg_id = heapq.heappop(heap)
+            if msg_id is None:
+                self._stale -= 1
+                continue
+            del self._entries[msg_id]
+            fired += 1
+            try:
+                next_at = self._on_fire(msg_id, when)
+            except Exception as e:
+                log.exception(f"❌ Грешка в планировчика: {e}", extra={"schedule_id": msg_id})
+                continue
+            if next_at is not None and msg_id not in self._entries:
+                self.schedule(msg_id, next_at)
+        return fired
+
+    def _delay(self, now: float) -> Optional[float]:
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            self._stale -= 1
+        if not heap:
+            return None
+        return max(0.0, heap[0][0] - now)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            self.run_due()
+            delay = self._delay(self.clock())
+            if delay == 0:
+                # Отстъпваме на event loop-а преди следващата порция
+                await asyncio.sleep(0)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._runner is not None and not self._runner.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
@@ -0,0 +1,483 @@
+import abc
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+log = logging.getLogger("amb.storage")
+
+
+# === Хранилище за съобщенията ===
+# Всичко, което ботът, офлайн CLI-то, клъстерът и webhook-ите ползват от
+# хранилището: запис/изтриване на един ред, групиране на поредица от промени
+# в един flush, дялове по guild, мета ключове и журнал на промените за
+# клъстерния режим. I/O е извън event loop-а.
+class ScheduleStore(abc.ABC):
+    # on_flush(продължителност, брой записи) - за метрики
+    on_flush: Optional[Callable[[float, int], None]] = None
+    # Процесът, записан в журнала changes (None = без журнал)
+    change_origin: Optional[str] = None
+
+    # --- Графици ---
+    @abc.abstractmethod
+    async def load_all(self) -> Dict[str, str]:
+        ...
+
+    @abc.abstractmethod
+    async def load_guild(self, guild_id: int) -> Dict[str, str]:
+        ...
+
+    @abc.abstractmethod
+    async def load_many(self, keys: List[str]) -> Dict[str, str]:
+        ...
+
+    @abc.abstractmethod
+    def iter_payloads(self, guild_id: Optional[int] = None, chunk_size: int = 1000) -> Iterator[Tuple[str, str]]:
+        ...
+
+    @abc.abstractmethod
+    def upsert(self, key: str, payload: str) -> None:
+        ...
+
+    def upsert_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        for key, payload in items:
+            self.upsert(key, payload)
+
+    @abc.abstractmethod
+    def update_runtime(self, key: str, payload: str, notify: bool = False) -> None:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def flush(self) -> None:
+        ...
+
+    # --- Guild-ове ---
+    @abc.abstractmethod
+    async def active_guilds(self) -> List[int]:
+        ...
+
+    @abc.abstractmethod
+    def set_guild_active(self, guild_id: int, active: bool) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def get_guild_config(self, guild_id: int) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    async def set_guild_config(self, guild_id: int, config: str) -> None:
+        ...
+
+    # --- Мета ключове ---
+    @abc.abstractmethod
+    async def get_meta(self, key: str) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    async def set_meta(self, key: str, value: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete_meta(self, key: str) -> None:
+        ...
+
+    # --- Клъстер: журнал на промените и живи процеси ---
+    @abc.abstractmethod
+    async def last_change_seq(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    async def changes_since(self, seq: int, limit: int = 5000) -> List[Tuple[int, str, str]]:
+        ...
+
+    @abc.abstractmethod
+    async def prune_changes(self, before: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def heartbeat(self, worker_id: str, at: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def live_workers(self, since: float) -> List[str]:
+        ...
+
+    @abc.abstractmethod
+    async def leave(self, worker_id: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        ...
+
+
+# SQLite в WAL режим. Всички операции вървят през една нишка, така че
+# връзката никога не се ползва паралелно. None в pending означава изтриване.
+class SqliteStore(ScheduleStore):
+    def __init__(self, path: str, flush_delay: float = 0.05):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.last_flush_duration = 0.0
+        # on_flush(продължителност, брой записи) - за метрики
+        self.on_flush: Optional[Callable[[float, int], None]] = None
+        # В клъстерен режим всеки запис добавя ред в changes със същата
+        # транзакция, за да го видят останалите процеси
+        self.change_origin: Optional[str] = None
+        self._pending: Dict[str, Optional[str]] = {}
+        # Ревизия на всеки пълен запис (пише се в колоната rev на реда)
+        self._pending_revs: Dict[str, int] = {}
+        # Само полетата по време на работа: key -> (payload, очаквана ревизия, в журнала ли)
+        self._pending_runtime: Dict[str, Tuple[str, Optional[int], bool]] = {}
+        # В клъстерен режим: последната видяна ревизия на всеки ред (виж update_runtime)
+        self._revs: Dict[str, int] = {}
+        # guild_id -> има ли активни графици (записва се в същата транзакция)
+        self._pending_guilds: Dict[int, bool] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Няколко процеса може да пишат в същата база - чакаме вместо "database is locked"
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("CREATE TABLE IF NOT EXISTS schedules (id TEXT PRIMARY KEY, data TEXT NOT NULL, rev INTEGER NOT NULL DEFAULT 0)")
+        if "rev" not in {row[1] for row in conn.execute("PRAGMA table_info(schedules)")}:
+            # База отпреди ревизиите
+            conn.execute("ALTER TABLE schedules ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, origin TEXT NOT NULL, at REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        # Настройки на guild и флаг "има активни графици" - при старт се
+        # зареждат само тези guild-ове, останалите при първо ползване
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS guilds "
+            "(guild_id INTEGER PRIMARY KEY, config TEXT, active INTEGER NOT NULL DEFAULT 0)"
+        )
+        return conn
+
+    @property
+    def tracks_revisions(self) -> bool:
+        # Ревизиите трябват само когато и други процеси пишат в базата
+        return self.change_origin is not None
+
+    def _read(self, sql: str, params: tuple = ()) -> List[Tuple[str, str, int]]:
+        return self._conn.execute(sql, params).fetchall()
+
+    def _remember(self, rows: List[Tuple[str, str, int]]) -> Dict[str, str]:
+        # Вика се в event loop-а, както update_runtime - ревизията и
+        # записът в паметта на извикващия се сменят заедно
+        if self.tracks_revisions:
+            self._revs.update((key, rev) for key, _, rev in rows)
+        return {key: data for key, data, _ in rows}
+
+    def _write(
+        self,
+        batch: Dict[str, Optional[str]],
+        guilds: Optional[Dict[int, bool]] = None,
+        revs: Optional[Dict[str, int]] = None,
+        runtime: Optional[Dict[str, Tuple[str, Optional[int], bool]]] = None
+    ) -> int:
+        # Връща броя пропуснати записи на полетата по време на работа
+        started = time.perf_counter()
+        revs = revs or {}
+        upserts = [(k, v, revs.get(k, 0)) for k, v in batch.items() if v is not None]
+        deletes = [(k,) for k, v in batch.items() if v is None]
+        changed = list(batch)
+        skipped = 0
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            if upserts:
+                conn.executemany(
+                    "INSERT INTO schedules (id, data, rev) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data, rev = excluded.rev",
+                    upserts,
+                )
+            if deletes:
+                conn.executemany("DELETE FROM schedules WHERE id = ?", deletes)
+            for key, (payload, rev, notify) in (runtime or {}).items():
+                # Само UPDATE: изтрит ред не се създава отново, а ред, променен
+                # от друг процес след последното ни четене (друга ревизия), не се пипа
+                if rev is None:
+                    cursor = conn.execute("UPDATE schedules SET data = ? WHERE id = ?", (payload, key))
+                else:
+                    cursor = conn.execute("UPDATE schedules SET data = ? WHERE id = ? AND rev = ?", (payload, key, rev))
+                if not cursor.rowcount:
+                    skipped += 1
+                elif notify:
+                    changed.append(key)
+            if guilds:
+                conn.executemany(
+                    "INSERT INTO guilds (guild_id, active) VALUES (?, ?) "
+                    "ON CONFLICT(guild_id) DO UPDATE SET active = excluded.active",
+                    [(guild_id, int(active)) for guild_id, active in guilds.items()]
+                )
+            if self.change_origin:
+                at = time.time()
+                conn.executemany(
+                    "INSERT INTO changes (key, origin, at) VALUES (?, ?, ?)",
+                    [(key, self.change_origin, at) for key in changed]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.last_flush_duration = time.perf_counter() - started
+        return skipped
+
+    async def load_all(self) -> Dict[str, str]:
+        await self.flush()
+        return self._remember(await self._call(self._read, "SELECT id, data, rev FROM schedules"))
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # --- Дялове по guild ---
+    # Ключовете са "<guild_id>:<id>" - един guild е интервал в първичния ключ
+    async def load_guild(self, guild_id: int) -> Dict[str, str]:
+        await self.flush()
+        start = f"{guild_id}:"
+        end = f"{guild_id};"
+        return self._remember(await self._call(
+            self._read, "SELECT id, data, rev FROM schedules WHERE id >= ? AND id < ?", (start, end)
+        ))
+
+    async def active_guilds(self) -> List[int]:
+        await self.flush()
+        rows = await self._call(lambda: self._conn.execute("SELECT guild_id FROM guilds WHERE active = 1").fetchall())
+        return [row[0] for row in rows]
+
+    def set_guild_active(self, guild_id: int, active: bool) -> None:
+        self._pending_guilds[guild_id] = active
+        self._request_flush()
+
+    async def get_guild_config(self, guild_id: int) -> Optional[str]:
+        row = await self._call(lambda: self._conn.execute(
+            "SELECT config FROM guilds WHERE guild_id = ?", (guild_id,)
+        ).fetchone())
+        return row[0] if row else None
+
+    async def set_guild_config(self, guild_id: int, config: str) -> None:
+        def write() -> None:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                conn.execute(
+                    "INSERT INTO guilds (guild_id, config) VALUES (?, ?) "
+                    "ON CONFLICT(guild_id) DO UPDATE SET config = excluded.config",
+                    (guild_id, config)
+                )
+                if self.change_origin:
+                    # Ключ "<guild_id>:" (без ID) в журнала = промяна на настройките
+                    conn.execute(
+                        "INSERT INTO changes (key, origin, at) VALUES (?, ?, ?)",
+                        (f"{guild_id}:", self.change_origin, time.time())
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        await self._call(write)
+
+    # --- Клъстер: журнал на промените и живи процеси ---
+    async def load_many(self, keys: List[str]) -> Dict[str, str]:
+        def read() -> List[Tuple[str, str, int]]:
+            rows = []
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                rows.extend(self._read(f"SELECT id, data, rev FROM schedules WHERE id IN ({marks})", tuple(chunk)))
+            return rows
+        return self._remember(await self._call(read))
+
+    async def last_change_seq(self) -> int:
+        row = await self._call(lambda: self._conn.execute("SELECT MAX(seq) FROM changes").fetchone())
+        return row[0] or 0
+
+    async def changes_since(self, seq: int, limit: int = 5000) -> List[Tuple[int, str, str]]:
+        return await self._call(lambda: self._conn.execute(
+            "SELECT seq, key, origin FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+        ).fetchall())
+
+    async def prune_changes(self, before: float) -> None:
+        await self._call(lambda: self._conn.execute("DELETE FROM changes WHERE at < ?", (before,)))
+
+    async def heartbeat(self, worker_id: str, at: float) -> None:
+        await self._call(lambda: self._conn.execute(
+            "INSERT INTO workers (worker_id, heartbeat) VALUES (?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (worker_id, at)
+        ))
+
+    async def live_workers(self, since: float) -> List[str]:
+        rows = await self._call(lambda: self._conn.execute(
+            "SELECT worker_id FROM workers WHERE heartbeat >= ? ORDER BY worker_id", (since,)
+        ).fetchall())
+        return [row[0] for row in rows]
+
+    async def leave(self, worker_id: str) -> None:
+        await self._call(lambda: self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,)))
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(
+            self._executor,
+            lambda: self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        )
+        return row[0] if row else None
+
+    async def set_meta(self, key: str, value: str) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor,
+            lambda: self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+        )
+
+    async def delete_meta(self, key: str) -> None:
+        await self._call(lambda: self._conn.execute("DELETE FROM meta WHERE key = ?", (key,)))
+
+    def _new_revision(self, key: str) -> None:
+        # Случайна, а не брояч: всеки процес избира ревизията на своя запис
+        # предварително, без да чака flush-а
+        rev = self._pending_revs[key] = random.getrandbits(62)
+        self._pending_runtime.pop(key, None)
+        if self.tracks_revisions:
+            self._revs[key] = rev
+
+    def upsert(self, key: str, payload: str) -> None:
+        self._pending[key] = payload
+        self._new_revision(key)
+        self._request_flush()
+
+    def upsert_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        # Цялата партида отива в същия pending -> една транзакция при flush
+        for key, payload in items:
+            self._pending[key] = payload
+            self._new_revision(key)
+        self._request_flush()
+
+    def update_runtime(self, key: str, payload: str, notify: bool = False) -> None:
+        # Запис от изпращането (фаза, брой изпращания, грешки): условен UPDATE
+        # на съществуващия ред при непроменена ревизия. Не влиза в журнала
+        # changes, освен с notify (смяна на статус/здраве, видима в /list).
+        if key in self._pending:
+            # Чакащ пълен запис/изтриване - новото съдържание отива в него
+            if self._pending[key] is not None:
+                self._pending[key] = payload
+            return
+        previous = self._pending_runtime.get(key)
+        self._pending_runtime[key] = (payload, self._revs.get(key), notify or (previous is not None and previous[2]))
+        self._request_flush()
+
+    def delete(self, key: str) -> None:
+        self._pending[key] = None
+        self._pending_revs.pop(key, None)
+        self._pending_runtime.pop(key, None)
+        self._revs.pop(key, None)
+        self._request_flush()
+
+    def _request_flush(self) -> None:
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Извън event loop (напр. при миграция) пишем директно
+            self._write_sync()
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+        else:
+            # Flush вече тече - новите промени ще хванат следващия
+            self._request_flush()
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done() and self._flush_task is not asyncio.current_task():
+            await self._flush_task
+        if not self._pending and not self._pending_guilds and not self._pending_runtime:
+            return
+        batch, revs, runtime, guilds = self._take_pending()
+        loop = asyncio.get_running_loop()
+        try:
+            skipped = await loop.run_in_executor(self._executor, self._write, batch, guilds, revs, runtime)
+        except Exception as e:
+            log.exception(f"❌ Грешка при запис в {self.path}: {e}", extra={"records": len(batch) + len(runtime)})
+            # Връщаме неуспелите промени, без да презаписваме по-новите
+            for key, payload in batch.items():
+                if key not in self._pending:
+                    self._pending[key] = payload
+                    if key in revs:
+                        self._pending_revs[key] = revs[key]
+                    self._pending_runtime.pop(key, None)
+            for key, update in runtime.items():
+                if key not in self._pending:
+                    self._pending_runtime.setdefault(key, update)
+            for guild_id, active in guilds.items():
+                self._pending_guilds.setdefault(guild_id, active)
+            self._request_flush()
+            return
+        if skipped:
+            log.debug(f"Пропуснати {skipped} записа от изпращането - редовете са изтрити или променени от друг процес")
+        if self.on_flush:
+            self.on_flush(self.last_flush_duration, len(batch) + len(runtime) - skipped)
+
+    def _take_pending(self) -> tuple:
+        batch, self._pending = self._pending, {}
+        revs, self._pending_revs = self._pending_revs, {}
+        runtime, self._pending_runtime = self._pending_runtime, {}
+        guilds, self._pending_guilds = self._pending_guilds, {}
+        return batch, revs, runtime, guilds
+
+    # --- Поточно четене (офлайн експорт) ---
+    # Блокиращо: редовете идват на порции от един курсор в реда на първичния
+    # ключ, така че паметта не зависи от размера на таблицата
+    def iter_payloads(self, guild_id: Optional[int] = None, chunk_size: int = 1000) -> Iterator[Tuple[str, str]]:
+        self._write_sync()
+        if guild_id is None:
+            sql, params = "SELECT id, data FROM schedules ORDER BY id", ()
+        else:
+            sql, params = "SELECT id, data FROM schedules WHERE id >= ? AND id < ? ORDER BY id", (f"{guild_id}:", f"{guild_id};")
+        cursor = self._executor.submit(self._conn.execute, sql, params).result()
+        try:
+            while True:
+                rows = self._executor.submit(cursor.fetchmany, chunk_size).result()
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            self._executor.submit(cursor.close).result()
+
+    def _write_sync(self) -> None:
+        if not self._pending and not self._pending_guilds and not self._pending_runtime:
+            return
+        batch, revs, runtime, guilds = self._take_pending()
+        self._executor.submit(self._write, batch, guilds, revs, runtime).result()
+
+    def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._write_sync()
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
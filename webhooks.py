@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Tuple
+
+import aiohttp
+import discord
+
+from cache import TTLCache
+from storage import ScheduleStore
+
+log = logging.getLogger("amb.webhooks")
+
+DELIVERY_BOT = "bot"
+DELIVERY_WEBHOOK = "webhook"
+DELIVERIES = (DELIVERY_BOT, DELIVERY_WEBHOOK)
+MAX_USERNAME_LENGTH = 80
+MAX_AVATAR_URL_LENGTH = 512
+
+
+# === Начин на изпращане ===
+# None/"bot" = channel.send от името на бота; "webhook" = през webhook на
+# канала, по желание с друго име и аватар. Грешките са ValueError с текст
+# за потребителя (както при validate_schedule).
+def validate_delivery(
+    delivery: Optional[str],
+    username: Optional[str] = None,
+    avatar_url: Optional[str] = None
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    delivery = (delivery or DELIVERY_BOT).strip().lower()
+    if delivery not in DELIVERIES:
+        raise ValueError(f"Невалиден начин на изпращане '{delivery}' (bot или webhook)")
+    if delivery == DELIVERY_BOT:
+        # Името и аватарът имат смисъл само за webhook
+        return None, None, None
+    username = (username or "").strip() or None
+    avatar_url = (avatar_url or "").strip() or None
+    if username is not None:
+        if len(username) > MAX_USERNAME_LENGTH:
+            raise ValueError(f"Името на webhook е над {MAX_USERNAME_LENGTH} символа")
+        # Discord отказва такива имена на webhook
+        if "discord" in username.lower() or "clyde" in username.lower():
+            raise ValueError("Името на webhook не може да съдържа 'discord' или 'clyde'")
+    if avatar_url is not None:
+        if not avatar_url.startswith(("https://", "http://")) or len(avatar_url) > MAX_AVATAR_URL_LENGTH:
+            raise ValueError("Аватарът трябва да е http(s) URL")
+    return DELIVERY_WEBHOOK, username, avatar_url
+
+
+# === Текстово поле за начина на изпращане (EditModal) ===
+# "bot", "webhook", "webhook: Новини" или "webhook: Новини | https://.../a.png"
+def format_delivery_spec(delivery: Optional[str], username: Optional[str], avatar_url: Optional[str]) -> str:
+    if delivery != DELIVERY_WEBHOOK:
+        return DELIVERY_BOT
+    if not username and not avatar_url:
+        return DELIVERY_WEBHOOK
+    spec = f"{DELIVERY_WEBHOOK}: {username}" if username else f"{DELIVERY_WEBHOOK}:"
+    return f"{spec} | {avatar_url}" if avatar_url else spec
+
+
+def parse_delivery_spec(text: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    delivery, _, rest = (text or "").partition(":")
+    username, _, avatar_url = rest.partition("|")
+    return validate_delivery(delivery, username, avatar_url)
+
+
+# === Кеш на webhook-ите по канал ===
+# Един webhook на канал, създаден от бота (или намерен по име). В meta
+# таблицата се пази само ID-то му (без токена), така че след рестарт и от
+# другите процеси в клъстера не се създава нов - токенът се взима с
+# fetch_webhook и живее само в паметта. Изпращането минава през общата
+# aiohttp сесия (keep-alive връзки), а не през HTTP клиента на бота -
+# webhook-ите имат собствени rate limit-и. Канал без право "Manage Webhooks"
+# се помни за unavailable_ttl секунди и през това време се ползва
+# channel.send. Webhook-ите и lock-овете са в ограничени кешове (maxsize
+# канала), а не по един запис за всеки канал досега.
+class WebhookPool:
+    def __init__(
+        self,
+        store: ScheduleStore,
+        resolve_channel: Callable[[int], Awaitable[object]],
+        fetch_webhook: Callable[[int], Awaitable[discord.Webhook]],
+        session: Callable[[], aiohttp.ClientSession],
+        name: str = "AutoMessageBot",
+        maxsize: int = 2048,
+        ttl: float = 3600.0,
+        unavailable_ttl: float = 600.0
+    ):
+        self.store = store
+        self.resolve_channel = resolve_channel
+        self.fetch_webhook = fetch_webhook
+        self.session = session
+        self.name = name
+        self._webhooks = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._locks = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._unavailable = TTLCache(maxsize=maxsize, ttl=unavailable_ttl)
+        self.created = 0
+
+    @staticmethod
+    def _meta_key(channel_id: int) -> str:
+        return f"webhook:{channel_id}"
+
+    async def get(self, channel_id: int) -> Optional[discord.Webhook]:
+        webhook = self._webhooks.get(channel_id)
+        if webhook is not None:
+            return webhook
+        if self._unavailable.get(channel_id):
+            return None
+        lock = self._locks.get(channel_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks.set(channel_id, lock)
+        async with lock:
+            webhook = self._webhooks.get(channel_id)
+            if webhook is None:
+                found = await self._load(channel_id) or await self._create(channel_id)
+                if found is None:
+                    return None
+                # Изпращането е през общата сесия, не през клиента на бота
+                webhook = discord.Webhook.partial(found.id, found.token, session=self.session())
+                self._webhooks.set(channel_id, webhook)
+        return webhook
+
+    async def _load(self, channel_id: int) -> Optional[discord.Webhook]:
+        stored = await self.store.get_meta(self._meta_key(channel_id))
+        if not stored:
+            return None
+        if not stored.isdigit():
+            # Стар запис с целия URL - остава само ID-то
+            try:
+                stored = str(discord.Webhook.from_url(stored, session=self.session()).id)
+            except ValueError:
+                await self.store.delete_meta(self._meta_key(channel_id))
+                return None
+            await self.store.set_meta(self._meta_key(channel_id), stored)
+        try:
+            webhook = await self.fetch_webhook(int(stored))
+        except discord.NotFound:
+            await self.store.delete_meta(self._meta_key(channel_id))
+            return None
+        return webhook if webhook.token else None
+
+    async def _create(self, channel_id: int) -> Optional[discord.Webhook]:
+        channel = await self.resolve_channel(channel_id)
+        if not isinstance(channel, discord.TextChannel):
+            self._unavailable.set(channel_id, True)
+            return None
+        try:
+            existing = [w for w in await channel.webhooks() if w.name == self.name and w.token]
+            webhook = existing[0] if existing else await channel.create_webhook(name=self.name, reason="AutoMessageBot: изпращане през webhook")
+        except discord.HTTPException as e:
+            # Forbidden (без "Manage Webhooks") или лимит на webhook-ите в канала
+            log.warning(f"⚠️ Webhook не може да се създаде ({e}) - ползва се channel.send", extra={"channel_id": channel_id})
+            self._unavailable.set(channel_id, True)
+            return None
+        if not existing:
+            self.created += 1
+            log.info("🪝 Създаден webhook", extra={"channel_id": channel_id})
+        await self.store.set_meta(self._meta_key(channel_id), str(webhook.id))
+        return webhook
+
+    async def forget(self, channel_id: int) -> None:
+        # Webhook-ът е изтрит в Discord - следващото изпращане създава нов
+        self._webhooks.pop(channel_id)
+        await self.store.delete_meta(self._meta_key(channel_id))